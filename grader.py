@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Batch grading of an exam, without the conversational agent.
+
+Every (student, question) answer becomes an independent grading job: the
+question, its solution, its rubric and the answer are sent in one short prompt,
+and the model replies with the points and the correction details. Jobs run
+concurrently (up to `--concurrency` requests in flight), rate-limited requests
+are retried with an exponential backoff, and the results are written back into
+the `points` / `correction_details` fields of the exam.
+
+Usage:
+    python grader.py <exam_filepath> [-r RUBRIC] [-c CONCURRENCY] [--regrade] [--failure-clusters]
+
+Arguments:
+    exam_filepath    Path to the exam YAML file, or to a sharded exam folder
+
+Options:
+    -r, --rubric       Rubric file (YAML or Markdown). A YAML mapping keyed by
+                       question id, or a list of entries with a `question_id`,
+                       gives one rubric per question. Any other content is used
+                       as the rubric of every question.
+    -c, --concurrency  Maximum number of concurrent LLM requests (default: 8)
+    --retries          Maximum number of retries of a rate-limited request (default: 6)
+    --regrade          Grade the answers that already have points too
+    --no-dedup         Grade every answer separately. By default, answers to the
+                       same question that are equivalent (same content up to
+                       whitespace, comments and identifier names for code, see
+                       `models/fingerprint.py`) are graded once, and the result
+                       is copied to all of them.
+    --failure-clusters Grade one answer per failure cluster of the unit tests (see
+                       `skills/run-unit-tests/scripts/failure_clusters.py`): the
+                       representative of each cluster is graded, and its result
+                       is copied to the other answers of the cluster. Only use it
+                       when the rubric grades the behaviour of the code, not its
+                       style. Only the clusters of answers that ran the tests
+                       (status `failed`) are shared: the answers that did not
+                       load, compile or finish (an empty answer and a misnamed
+                       function fail the same way) and the ones passing all the
+                       tests are graded as usual.
+    --no-cache         Ignore the cached LLM responses (see `llm_cache.py`). By
+                       default, a request identical to a previous one (same
+                       model, question, rubric and answer) reuses its response,
+                       so regrading after a rubric change only sends the
+                       requests of the modified questions.
+
+Notes:
+    - The model is read from OPENGRADER_MODEL, like the agent
+    - Students of a sharded exam are saved as soon as all their answers are graded,
+      a single-file exam is saved once at the end (also when interrupted)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_litellm import ChatLiteLLM
+import litellm
+from ruamel.yaml import YAML
+from ruamel.yaml.scalarstring import LiteralScalarString
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "models"))
+
+import exam_store
+from fingerprint import answer_fingerprint, question_kept_names
+from llm_cache import get_llm_cache, refreshing
+from utils import setup_logging
+
+
+DEFAULT_MODEL = "openrouter/google/gemini-3-flash-preview"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRIES = 6
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+
+# Errors worth retrying: the request can succeed later without any change
+RETRYABLE_ERRORS = (
+    litellm.RateLimitError,
+    litellm.Timeout,
+    litellm.APIConnectionError,
+    litellm.ServiceUnavailableError,
+    litellm.InternalServerError,
+)
+
+GRADING_INSTRUCTIONS = """You are OpenGrader, grading one answer of a student to an exam question.
+
+Grade the answer strictly according to the rubric when one is given, otherwise
+according to the question and its solution. Be fair and consistent: the same
+answer must always get the same grade.
+
+Reply with a single JSON object, and nothing else:
+{"points": <number between 0 and the maximum points>, "correction_details": "<short justification, in the language of the question>"}
+"""
+
+
+@dataclass
+class GradingJob:
+    student: dict
+    question: dict
+    answer: dict
+
+
+@dataclass
+class GradingResult:
+    points: float
+    correction_details: str
+
+
+def load_rubric(rubric_filepath) -> Dict[Optional[int], str]:
+    """Load a rubric file.
+
+    Returns:
+        Dict question_id -> rubric text. The key None holds the rubric common
+        to all the questions.
+    """
+    if rubric_filepath is None:
+        return {}
+    text = Path(rubric_filepath).read_text(encoding="utf-8")
+
+    try:
+        data = YAML(typ="safe").load(text)
+    except Exception:
+        data = None
+
+    def dump(value) -> str:
+        if isinstance(value, str):
+            return value
+        return json.dumps(value, ensure_ascii=False, indent=2, default=str)
+
+    rubric = {}
+    if isinstance(data, dict) and data and all(
+        isinstance(k, int) or (isinstance(k, str) and k.isdigit()) for k in data
+    ):
+        rubric = {int(k): dump(v) for k, v in data.items()}
+    elif isinstance(data, list) and data and all(
+        isinstance(item, dict) and "question_id" in item for item in data
+    ):
+        for item in data:
+            rubric[int(item["question_id"])] = dump(item)
+
+    return rubric or {None: text}
+
+
+def build_prompt(job: GradingJob, rubric: Dict[Optional[int], str]) -> list:
+    question = job.question
+    parts = [
+        f"## Question {question['id']}: {question.get('name', '')}",
+        f"Type: {question.get('type', 'open')}",
+        f"Maximum points: {question['max_points']}",
+        "",
+        question.get("description", ""),
+    ]
+    if question.get("solution"):
+        parts += ["", "## Solution", question["solution"]]
+
+    question_rubric = rubric.get(question["id"], rubric.get(None))
+    if question_rubric:
+        parts += ["", "## Rubric", question_rubric]
+
+    parts += ["", "## Student answer", job.answer.get("content") or "(empty answer)"]
+
+    return [
+        SystemMessage(content=GRADING_INSTRUCTIONS),
+        HumanMessage(content="\n".join(str(p) for p in parts)),
+    ]
+
+
+def parse_response(text: str, max_points: float) -> GradingResult:
+    """Parse the JSON reply of the model, tolerating code fences around it."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        raise ValueError(f"No JSON object in the model response: {text[:200]!r}")
+    data = json.loads(match.group(0))
+
+    points = float(data["points"])
+    points = min(max(points, 0.0), float(max_points))
+    details = str(data.get("correction_details") or "").strip()
+    return GradingResult(points=points, correction_details=details)
+
+
+def retry_delay(error, attempt: int) -> float:
+    """Delay before the next attempt: the server hint if any, else exponential backoff with jitter."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return min(float(headers["retry-after"]), BACKOFF_MAX)
+    except (KeyError, TypeError, ValueError):
+        pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class BatchGrader:
+    """
+    Grade all the answers of an exam with one LLM request per answer.
+    """
+
+    def __init__(
+        self,
+        rubric: Dict[Optional[int], str] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        retries: int = DEFAULT_RETRIES,
+        model=None,
+        use_cache: bool = True,
+    ):
+        """
+        Args:
+            rubric: Rubric texts by question id (see `load_rubric`)
+            concurrency: Maximum number of concurrent LLM requests
+            retries: Maximum number of retries of a failed request
+            model: Chat model to use, defaults to OPENGRADER_MODEL through LiteLLM
+            use_cache: Reuse the cached responses to identical requests (see `llm_cache.py`),
+                only used with the default model
+        """
+        self.rubric = rubric or {}
+        self.concurrency = concurrency
+        self.retries = retries
+        self.logger = setup_logging("OpenGraderBatch")
+
+        if model is None:
+            model_name = os.getenv("OPENGRADER_MODEL", DEFAULT_MODEL)
+            # Low temperature: grading must be reproducible
+            model = ChatLiteLLM(model=model_name, temperature=0.0, cache=get_llm_cache(use_cache))
+        self.model = model
+
+    async def grade_job(self, job: GradingJob, semaphore: asyncio.Semaphore) -> GradingResult:
+        messages = build_prompt(job, self.rubric)
+        attempt = 0
+        # After a malformed reply, the cached one (if any) must not be replayed
+        refresh = False
+        while True:
+            async with semaphore:
+                try:
+                    with refreshing(refresh):
+                        response = await self.model.ainvoke(messages)
+                    return parse_response(response.content, job.question["max_points"])
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.retries:
+                        raise
+                    delay = retry_delay(e, attempt)
+                except (ValueError, KeyError, TypeError) as e:
+                    # Malformed reply: ask again, without waiting
+                    if attempt >= self.retries:
+                        raise ValueError(f"Invalid grading response: {e}") from e
+                    delay = 0
+                    refresh = True
+            # Sleep outside of the semaphore, so other jobs can use the slot
+            attempt += 1
+            self.logger.warning(
+                f"Retrying {job.student.get('firstname')} {job.student.get('lastname')} "
+                f"Q{job.question['id']} in {delay:.1f}s (attempt {attempt})"
+            )
+            await asyncio.sleep(delay)
+
+    async def grade_students(
+        self,
+        questions: List[dict],
+        students: List[dict],
+        regrade=False,
+        dedup=True,
+        on_student=None,
+        failure_clusters=False,
+    ):
+        """Grade the answers of `students` in place.
+
+        Args:
+            questions: Questions of the exam
+            students: Students to grade, their answers are updated in place
+            regrade: Grade the answers that already have points too
+            dedup: Grade equivalent answers to the same question once (see `fingerprint.py`)
+            on_student: Called with each student once all their answers are graded
+            failure_clusters: Grade the answers of a failure cluster of the unit
+                tests (`unit_test_results.cluster`) once, with its representative.
+                Only for the answers whose run reached the tests (status `failed`)
+
+        Returns:
+            Dict (firstname, lastname, question_id) -> error message, for the failed jobs
+        """
+        question_index = {q["id"]: q for q in questions}
+        kept_names = {q["id"]: question_kept_names(q) for q in questions}
+
+        # Jobs sharing a fingerprint (or a failure cluster) are graded once, by their first job
+        groups = {}
+        pending = {}
+        for student in students:
+            pending[id(student)] = 0
+            for answer in student.get("answers") or []:
+                question = question_index.get(answer.get("question_id"))
+                if question is None or (not regrade and answer.get("points") is not None):
+                    continue
+                job = GradingJob(student, question, answer)
+                tests = answer.get("unit_test_results") or {}
+                # The answers that did not reach the tests (error, timeout...) share
+                # a coarse signature whatever their content, they are not clustered
+                clustered = failure_clusters and tests.get("cluster") and tests.get("status") == "failed"
+                if clustered:
+                    key = ("cluster", question["id"], tests["cluster"])
+                elif dedup:
+                    key = answer_fingerprint(answer.get("content"), question, kept_names[question["id"]])
+                else:
+                    key = len(groups)
+                group = groups.setdefault(key, [])
+                if clustered and tests.get("representative"):
+                    group.insert(0, job)
+                else:
+                    group.append(job)
+                pending[id(student)] += 1
+
+        for student in students:
+            if pending[id(student)] == 0 and on_student is not None:
+                on_student(student)
+
+        total = sum(len(group) for group in groups.values())
+        if (dedup or failure_clusters) and total:
+            print(f"{total} answers to grade, {len(groups)} distinct")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failures = {}
+        # Counted apart from `failures`, keyed by name: students may share one
+        graded = failed = 0
+        start = time.perf_counter()
+
+        async def run(group: List[GradingJob]):
+            nonlocal graded, failed
+            result, error = None, None
+            try:
+                result = await self.grade_job(group[0], semaphore)
+            except Exception as e:
+                key = (group[0].student.get("firstname"), group[0].student.get("lastname"), group[0].question["id"])
+                self.logger.error(f"Grading failed for {key}: {e}", exc_info=True)
+                error = str(e)
+
+            for job in group:
+                if result is not None:
+                    job.answer["points"] = result.points
+                    details = result.correction_details
+                    job.answer["correction_details"] = (
+                        LiteralScalarString(details) if "\n" in details else details
+                    )
+                    graded += 1
+                else:
+                    key = (job.student.get("firstname"), job.student.get("lastname"), job.question["id"])
+                    failures[key] = error
+                    failed += 1
+
+                pending[id(job.student)] -= 1
+                if pending[id(job.student)] == 0 and on_student is not None:
+                    on_student(job.student)
+            print(
+                f"\rGraded {graded}/{total} answers" + (f", {failed} failed" if failed else ""),
+                end="",
+                flush=True,
+            )
+
+        await asyncio.gather(*(run(group) for group in groups.values()))
+        if total:
+            print()
+        self.logger.info(
+            f"Graded {graded}/{total} answers ({failed} failed) with {len(groups)} requests "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+        return failures
+
+    async def grade_exam(self, exam_path, regrade=False, dedup=True, failure_clusters=False):
+        """Grade an exam and write the results back to it.
+
+        Args:
+            exam_path: Path to the exam YAML file, or to a sharded exam folder
+            regrade: Grade the answers that already have points too
+            dedup: Grade equivalent answers to the same question once
+            failure_clusters: Grade the answers of a failure cluster once
+
+        Returns:
+            Dict (firstname, lastname, question_id) -> error message, for the failed jobs
+        """
+        exam_path = Path(exam_path)
+        if exam_store.is_sharded(exam_path):
+            data = exam_store.load_header(exam_path)
+            students = list(exam_store.iter_students(exam_path))
+            return await self.grade_students(
+                data.get("questions") or [],
+                students,
+                regrade=regrade,
+                dedup=dedup,
+                on_student=lambda student: exam_store.save_student(exam_path, student),
+                failure_clusters=failure_clusters,
+            )
+
+        data = exam_store.load_yaml_file(exam_path, cached=True)
+        try:
+            return await self.grade_students(
+                data.get("questions") or [],
+                data.get("student_response") or [],
+                regrade=regrade,
+                dedup=dedup,
+                failure_clusters=failure_clusters,
+            )
+        finally:
+            # Also keep the answers graded so far when interrupted
+            exam_store.dump_yaml_file(data, exam_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade all the answers of an exam in batch")
+    parser.add_argument("exam_filepath", help="Exam YAML file path, or sharded exam folder")
+    parser.add_argument("-r", "--rubric", help="Rubric file (YAML or Markdown)")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Maximum number of concurrent LLM requests (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Maximum number of retries of a failed request (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--regrade", action="store_true", help="Grade already graded answers too")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Grade every answer separately, even identical ones")
+    parser.add_argument("--failure-clusters", action="store_true",
+                        help="Grade the representative of each unit test failure cluster, "
+                             "and copy its result to the cluster")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Send every request to the model, ignoring the cached responses")
+    args = parser.parse_args()
+
+    grader = BatchGrader(
+        rubric=load_rubric(args.rubric),
+        concurrency=args.concurrency,
+        retries=args.retries,
+        use_cache=not args.no_cache,
+    )
+    failures = asyncio.run(grader.grade_exam(
+        args.exam_filepath,
+        regrade=args.regrade,
+        dedup=not args.no_dedup,
+        failure_clusters=args.failure_clusters,
+    ))
+
+    if failures:
+        print(f"{len(failures)} answer(s) could not be graded:")
+        for (firstname, lastname, question_id), error in failures.items():
+            print(f"  - {firstname} {lastname}, question {question_id}: {error}")
+        sys.exit(1)
+    print("All answers graded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# Persistent cache of LLM responses for OpenGrader
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, Generation
+
+
+DEFAULT_TTL = 30 * 24 * 3600  # 30 days
+DEFAULT_MAX_ENTRIES = 50_000
+# Eviction scans the table, it runs once every EVICT_EVERY updates
+EVICT_EVERY = 100
+
+# Only responses are stored, nothing else is revived from the database
+CACHED_TYPES = [Generation, ChatGeneration, ChatGenerationChunk, AIMessage, AIMessageChunk]
+
+# Environment variable disabling the cache (e.g. OPENGRADER_NO_LLM_CACHE=1)
+BYPASS_ENV = "OPENGRADER_NO_LLM_CACHE"
+
+# Set by `refreshing`, per task: the async lookups run in a copy of the context
+_refreshing = ContextVar("opengrader_llm_cache_refreshing", default=False)
+
+
+def default_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "opengrader" / "llm_cache.db"
+
+
+def cache_bypassed() -> bool:
+    return os.environ.get(BYPASS_ENV, "").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def refreshing(enabled: bool = True):
+    """Replace the cached responses of the requests sent in this context.
+
+    The lookups miss and drop their entry, so the new response is stored in
+    its place. Used to ask again when a cached response cannot be used (e.g.
+    malformed), instead of replaying it.
+    """
+    token = _refreshing.set(enabled)
+    try:
+        yield
+    finally:
+        _refreshing.reset(token)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a serialized prompt, so insignificant differences hit the same entry.
+
+    Trailing whitespace of every line of the messages is dropped, and the keys
+    are sorted.
+    """
+    def normalize(value):
+        if isinstance(value, str):
+            return "\n".join(line.rstrip() for line in value.strip().splitlines())
+        if isinstance(value, list):
+            return [normalize(v) for v in value]
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        return value
+
+    try:
+        return json.dumps(normalize(json.loads(prompt)), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        return normalize(prompt)
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    LangChain cache of chat model responses, stored in a SQLite database.
+
+    Entries are keyed by the model configuration given by LangChain (model name,
+    temperature, stop words, ...) and the normalized messages. They expire after
+    `ttl` seconds, and the least recently used entries are evicted beyond
+    `max_entries`.
+    """
+
+    def __init__(
+        self,
+        database_path=None,
+        ttl: Optional[float] = DEFAULT_TTL,
+        max_entries: Optional[int] = DEFAULT_MAX_ENTRIES,
+    ):
+        """
+        Args:
+            database_path: SQLite file (defaults to ~/.cache/opengrader/llm_cache.db)
+            ttl: Lifetime of an entry in seconds, None for no expiration
+            max_entries: Maximum number of entries, None for no limit
+        """
+        self.database_path = Path(database_path or default_cache_path())
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._updates = 0
+
+        # Shared between threads: async model calls look the cache up in an executor
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.database_path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    llm_string TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+            self._evict(time.time())
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        content = f"{llm_string}\0{normalize_prompt(prompt)}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if _refreshing.get() or (self.ttl is not None and created_at + self.ttl < now):
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+
+        try:
+            return loads(value, allowed_objects=CACHED_TYPES)
+        except Exception:
+            # Entry written by an incompatible version of LangChain
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        value = dumps(list(return_val))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, llm_string, value, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, llm_string, value, now, now),
+            )
+            self._updates += 1
+            if self._updates % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+def get_llm_cache(use_cache: bool = True):
+    """Cache to give to a chat model (`cache=` argument).
+
+    Returns:
+        A SQLite cache in the default location, or False to disable caching when `use_cache` is
+        False or OPENGRADER_NO_LLM_CACHE is set.
+    """
+    if not use_cache or cache_bypassed():
+        return False
+    return SQLiteLLMCache()
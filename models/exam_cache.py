@@ -0,0 +1,116 @@
+"""
+Parse cache for exam YAML files.
+
+Round-trip parsing of a large exam with ruamel takes seconds, and every script
+invocation parses the same file again. The parsed document is pickled in a
+cache folder private to the user (`~/.cache/opengrader/exams/`, or
+`$XDG_CACHE_HOME/opengrader/exams/`, mode 0700): never next to the exam, whose
+folder may be shared, as unpickling a file written by someone else runs their
+code.
+
+A cache entry is keyed by the path of the file and by the hash of its content,
+which is always checked: hashing is cheap next to parsing, and a modification
+time may not change when the file is edited (coarse timestamps, same size).
+"""
+
+import hashlib
+import os
+import pickle
+import sys
+from pathlib import Path
+
+import ruamel.yaml
+
+
+# Bump to invalidate all the cache entries if their format changes
+CACHE_VERSION = 2
+
+
+def default_cache_folder() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "opengrader" / "exams"
+
+
+def private_cache_folder() -> Path:
+    """The cache folder, created if needed, or None if other users can write to it."""
+    folder = default_cache_folder()
+    folder.mkdir(mode=0o700, parents=True, exist_ok=True)
+    stat = folder.stat()
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        return None
+    return folder
+
+
+def cache_filepath(filepath: Path) -> Path:
+    folder = private_cache_folder()
+    if folder is None:
+        raise PermissionError(f"The cache folder {default_cache_folder()} is not private")
+    name = hashlib.sha256(str(filepath.resolve()).encode("utf-8")).hexdigest()
+    return folder / f"{name}.cache"
+
+
+def loader_id(yaml) -> str:
+    """Identify the loader, entries created by another loader are not reused."""
+    return (
+        f"{CACHE_VERSION}:{sys.version_info[:2]}:{ruamel.yaml.__version__}:"
+        f"{yaml.typ}:{yaml.preserve_quotes}"
+    )
+
+
+def file_key(filepath: Path, content: bytes) -> dict:
+    return {
+        "path": str(filepath.resolve()),
+        "hash": hashlib.sha256(content).hexdigest(),
+    }
+
+
+def read_entry(filepath: Path, yaml, content: bytes):
+    """Return the cached document for `filepath` with `content`, or None if there is no valid entry.
+
+    The key is stored before the document in the cache file, so a stale entry
+    is detected without unpickling the whole document.
+    """
+    try:
+        with open(cache_filepath(filepath), "rb") as f:
+            cached_key = pickle.load(f)
+            if cached_key != dict(file_key(filepath, content), loader=loader_id(yaml)):
+                return None
+            return pickle.load(f)
+    except Exception:
+        # Missing, corrupted or incompatible entry
+        return None
+
+
+def write_entry(filepath: Path, yaml, data, key: dict):
+    key = dict(key, loader=loader_id(yaml))
+    try:
+        target = cache_filepath(filepath)
+    except OSError:
+        return
+    tmp_target = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_target, "wb") as f:
+            pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_target.replace(target)
+    except (OSError, pickle.PicklingError):
+        # The cache is an optimization, a full disk must not break loading
+        tmp_target.unlink(missing_ok=True)
+
+
+def load_yaml_cached(filepath, yaml):
+    """Load a YAML file with `yaml`, going through the parse cache.
+
+    Every call returns a new copy of the document, callers can modify it.
+    """
+    filepath = Path(filepath)
+    content = filepath.read_bytes()
+
+    data = read_entry(filepath, yaml, content)
+    if data is not None:
+        return data
+
+    key = file_key(filepath, content)
+    data = yaml.load(content.decode("utf-8"))
+    write_entry(filepath, yaml, data, key)
+    return data
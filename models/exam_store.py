@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Sharded storage of exam files.
+
+An exam is normally a single YAML file following `schema.yaml`. With many
+students, every update of this file means parsing and re-serializing all the
+answers. The sharded layout splits the same logical exam into:
+
+    <exam>/
+    ├── exam.yaml           All the fields of the exam, except `student_response`
+    └── students/
+        ├── John_Doe.yaml   One entry of `student_response` per file
+        └── ...
+
+`load_exam` presents both layouts as the same logical exam, `iter_students`
+reads the students lazily, and `save_student` updates a single student file.
+
+Usage:
+    python exam_store.py split <exam.yaml> <exam_folder>
+    python exam_store.py join <exam_folder> <exam.yaml>
+
+Notes:
+    - The students of a sharded exam are ordered by file name
+    - Students whose names give the same file name (accents, punctuation, or
+      two students with the same name in a single-file exam) get a numeric
+      suffix: `Jose_Diaz.yaml`, `Jose_Diaz-2.yaml`
+    - `split` and `join` leave their source untouched
+"""
+
+import argparse
+import itertools
+import re
+import weakref
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+from ruamel.yaml import YAML
+
+from exam_cache import load_yaml_cached
+
+
+HEADER_FILENAME = "exam.yaml"
+STUDENTS_FOLDER = "students"
+
+yaml = YAML()
+yaml.preserve_quotes = True
+yaml.sort_base_mapping_type_on_output = False
+yaml.default_flow_style = False
+
+# File of every student loaded from a sharded exam, to save it back to the same
+# file: id of the student -> (weak reference to the student, path)
+_loaded_from = {}
+
+
+def is_sharded(exam_path) -> bool:
+    """Whether `exam_path` is an exam in the sharded layout."""
+    return (Path(exam_path) / HEADER_FILENAME).is_file()
+
+
+def student_filename(firstname: str, lastname: str, number: int = 1) -> str:
+    name = re.sub(r"[^\w.-]+", "-", f"{firstname}_{lastname}")
+    return f"{name}.yaml" if number == 1 else f"{name}-{number}.yaml"
+
+
+def remember_file(student, filepath: Path):
+    key = id(student)
+    try:
+        _loaded_from[key] = (weakref.ref(student, lambda _: _loaded_from.pop(key, None)), filepath)
+    except TypeError:
+        # Not a loaded mapping (e.g. an empty file)
+        pass
+
+
+def student_filepath(folder: Path, student: dict, new: bool = False) -> Path:
+    """File of `student` in the students `folder` of a sharded exam.
+
+    The file the student was loaded from, else the file of the student with
+    the same firstname and lastname, else the first free file name.
+
+    Args:
+        new: Always use a free file name (another student with the same name)
+    """
+    loaded = _loaded_from.get(id(student))
+    if not new and loaded is not None and loaded[0]() is student and loaded[1].parent == folder:
+        return loaded[1]
+
+    names = (student.get("firstname", ""), student.get("lastname", ""))
+    for number in itertools.count(1):
+        filepath = folder / student_filename(*names, number)
+        if not filepath.exists():
+            return filepath
+        if not new:
+            other = load_yaml_file(filepath) or {}
+            if (other.get("firstname", ""), other.get("lastname", "")) == names:
+                return filepath
+
+
+def student_keys(students: Iterable[dict]) -> Dict[int, str]:
+    """Unique key of every student of an exam: id of the student -> key.
+
+    The key of a student loaded from a sharded exam is the name of its file,
+    without `.yaml`. The other students get the name their file would have
+    after `split_exam`: students with the same name get a numeric suffix, in
+    order (`Jose_Diaz`, `Jose_Diaz-2`). The keys do not change when an exam is
+    split or joined.
+    """
+    keys = {}
+    used = set()
+    for student in students:
+        loaded = _loaded_from.get(id(student))
+        if loaded is not None and loaded[0]() is student:
+            key = loaded[1].stem
+        else:
+            names = (student.get("firstname", ""), student.get("lastname", ""))
+            stems = (Path(student_filename(*names, number)).stem for number in itertools.count(1))
+            key = next(stem for stem in stems if stem not in used)
+        used.add(key)
+        keys[id(student)] = key
+    return keys
+
+
+def load_yaml_file(filepath, cached: bool = False):
+    """Load a YAML file.
+
+    Args:
+        filepath: Path to the YAML file
+        cached: Go through the parse cache (see `exam_cache.py`). Used for
+            single-file exams, whose parsing is expensive.
+    """
+    if cached:
+        return load_yaml_cached(filepath, yaml)
+    with open(filepath, "r", encoding="utf-8") as f:
+        return yaml.load(f)
+
+
+def dump_yaml_file(data, filepath):
+    """Dump `data` to `filepath`, replacing it atomically."""
+    filepath = Path(filepath)
+    tmp_filepath = filepath.with_name(filepath.name + ".tmp")
+    with open(tmp_filepath, "w", encoding="utf-8") as f:
+        yaml.dump(data, f)
+    tmp_filepath.replace(filepath)
+
+
+def student_files(exam_path) -> list:
+    folder = Path(exam_path) / STUDENTS_FOLDER
+    if not folder.is_dir():
+        return []
+    return sorted(folder.glob("*.yaml"))
+
+
+def load_header(exam_path):
+    """Load the exam without its students.
+
+    Returns:
+        The exam data, with an empty `student_response`
+    """
+    exam_path = Path(exam_path)
+    if is_sharded(exam_path):
+        data = load_yaml_file(exam_path / HEADER_FILENAME) or {}
+    else:
+        data = load_yaml_file(exam_path, cached=True) or {}
+    data["student_response"] = []
+    return data
+
+
+def iter_students(exam_path) -> Iterator[dict]:
+    """Lazily iterate the students of an exam, in either layout.
+
+    For a sharded exam, only one student file is loaded at a time.
+    """
+    exam_path = Path(exam_path)
+    if is_sharded(exam_path):
+        for filepath in student_files(exam_path):
+            student = load_yaml_file(filepath)
+            remember_file(student, filepath)
+            yield student
+    else:
+        data = load_yaml_file(exam_path, cached=True) or {}
+        yield from data.get("student_response") or []
+
+
+def count_students(exam_path) -> int:
+    exam_path = Path(exam_path)
+    if is_sharded(exam_path):
+        return len(student_files(exam_path))
+    data = load_yaml_file(exam_path, cached=True) or {}
+    return len(data.get("student_response") or [])
+
+
+def load_exam(exam_path):
+    """Load the whole logical exam (questions and students), in either layout."""
+    exam_path = Path(exam_path)
+    if not is_sharded(exam_path):
+        return load_yaml_file(exam_path, cached=True)
+    data = load_header(exam_path)
+    data["student_response"].extend(iter_students(exam_path))
+    return data
+
+
+def save_student(exam_path, student: dict, new: bool = False) -> Path:
+    """Add or replace one student of a sharded exam.
+
+    A student loaded with `iter_students` is saved to its file, any other
+    student replaces the one with the same firstname and lastname.
+
+    Args:
+        new: Add the student even if another one has the same name
+
+    Returns:
+        The file of the student
+    """
+    folder = Path(exam_path) / STUDENTS_FOLDER
+    folder.mkdir(exist_ok=True)
+    filepath = student_filepath(folder, student, new)
+    dump_yaml_file(student, filepath)
+    remember_file(student, filepath)
+    return filepath
+
+
+def split_exam(exam_filepath, exam_folder):
+    """Convert a single-file exam to the sharded layout."""
+    exam_folder = Path(exam_folder)
+    exam_folder.mkdir(parents=True, exist_ok=True)
+
+    data = load_yaml_file(exam_filepath, cached=True) or {}
+    students = data.pop("student_response", None) or []
+
+    dump_yaml_file(data, exam_folder / HEADER_FILENAME)
+    # Students with the same name are different students of the exam
+    written = set()
+    for student in students:
+        new = student_filepath(exam_folder / STUDENTS_FOLDER, student) in written
+        written.add(save_student(exam_folder, student, new))
+
+
+def join_exam(exam_folder, exam_filepath):
+    """Convert a sharded exam to a single-file exam."""
+    exam_filepath = Path(exam_filepath)
+    exam_filepath.parent.mkdir(parents=True, exist_ok=True)
+    dump_yaml_file(load_exam(exam_folder), exam_filepath)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert exams between the single-file and the sharded layout"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = subparsers.add_parser("split", help="Single YAML file -> sharded folder")
+    split_parser.add_argument("exam_filepath", help="Source exam YAML file")
+    split_parser.add_argument("exam_folder", help="Destination exam folder")
+
+    join_parser = subparsers.add_parser("join", help="Sharded folder -> single YAML file")
+    join_parser.add_argument("exam_folder", help="Source exam folder")
+    join_parser.add_argument("exam_filepath", help="Destination exam YAML file")
+
+    args = parser.parse_args()
+
+    if args.command == "split":
+        split_exam(args.exam_filepath, args.exam_folder)
+    else:
+        join_exam(args.exam_folder, args.exam_filepath)
+
+
+if __name__ == "__main__":
+    main()
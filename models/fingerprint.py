@@ -0,0 +1,326 @@
+"""
+Fingerprints of student answers, to grade identical answers only once.
+
+An answer is normalized according to the type of its question before hashing:
+
+- Every type: leading/trailing whitespace is dropped, runs of whitespace are collapsed
+- Code (`python`, `javascript`, `java`, `cpp`): comments are dropped, and the
+  names the answer binds itself (parameters, assigned and declared variables,
+  loop variables, helper functions) are renamed in order of first appearance
+  (`v0`, `v1`, ...), so answers that only differ by their variable names share
+  a fingerprint. Every other name is kept: imported names, attributes, free
+  names such as library functions (`floor` and `ceil`, `sort` and `reverse`
+  are different answers), and the identifiers used by the question itself
+  (its description, solution and unit tests, e.g. the name of the function to
+  write).
+
+Answers that cannot be tokenized (e.g. Python with a syntax error) fall back to
+the whitespace normalization.
+"""
+
+import ast
+import builtins
+import hashlib
+import io
+import keyword
+import re
+import tokenize
+from typing import Iterable, List, Set, Tuple
+
+
+CODE_TYPES = {"python", "javascript", "java", "cpp"}
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$]*")
+
+# Strings first, so comment markers inside strings are left alone
+C_LIKE_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+    |(?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<identifier>[A-Za-z_$][\w$]*)
+    |(?P<number>\d[\w.]*)
+    |(?P<operator>::|->|=>|>>|<<|&&|\|\||\+\+|--|[-+*/%&|^!=<>]=)
+    |(?P<space>\s+)
+    |(?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+C_LIKE_KEYWORDS = {
+    "javascript": {
+        "async", "await", "break", "case", "catch", "class", "const", "continue",
+        "debugger", "default", "delete", "do", "else", "export", "extends", "false",
+        "finally", "for", "function", "if", "import", "in", "instanceof", "let", "new",
+        "null", "of", "return", "static", "super", "switch", "this", "throw", "true",
+        "try", "typeof", "undefined", "var", "void", "while", "yield",
+        "Array", "Math", "Map", "Set", "Object", "String", "Number", "JSON", "console",
+        "length", "push", "pop", "log",
+    },
+    "java": {
+        "abstract", "boolean", "break", "byte", "case", "catch", "char", "class",
+        "continue", "default", "do", "double", "else", "enum", "extends", "false",
+        "final", "finally", "float", "for", "if", "implements", "import", "instanceof",
+        "int", "interface", "long", "new", "null", "package", "private", "protected",
+        "public", "return", "short", "static", "super", "switch", "this", "throw",
+        "throws", "true", "try", "var", "void", "while",
+        "String", "System", "Math", "Integer", "List", "ArrayList", "Map", "HashMap",
+        "out", "println", "length", "size", "get", "add", "main", "args",
+    },
+    "cpp": {
+        "auto", "bool", "break", "case", "catch", "char", "class", "const",
+        "continue", "default", "delete", "do", "double", "else", "enum", "false",
+        "float", "for", "if", "include", "int", "long", "namespace", "new",
+        "nullptr", "private", "protected", "public", "return", "short", "signed",
+        "sizeof", "static", "std", "struct", "switch", "template", "this", "throw",
+        "true", "try", "typename", "unsigned", "using", "void", "while",
+        "cout", "cin", "endl", "string", "vector", "map", "size", "push_back", "main",
+    },
+}
+
+# Keywords after which an identifier is declared (`int x`, `let x`, `function f`)
+C_LIKE_DECLARATION_KEYWORDS = {
+    "javascript": {"let", "const", "var", "function", "class"},
+    "java": {
+        "boolean", "byte", "char", "class", "double", "final", "float", "int", "long",
+        "short", "var", "String", "Integer", "List", "ArrayList", "Map", "HashMap",
+    },
+    "cpp": {
+        "auto", "bool", "char", "class", "const", "double", "float", "int", "long",
+        "short", "signed", "struct", "unsigned", "string", "vector", "map",
+    },
+}
+
+# Tokens following a declared identifier
+C_LIKE_DECLARATION_ENDS = {"=", ";", ",", ")", "[", ":", "(", "{"}
+
+PYTHON_KEPT_NAMES = set(keyword.kwlist) | set(keyword.softkwlist) | set(dir(builtins)) | {"self", "cls"}
+
+
+def normalize_whitespace(content: str) -> str:
+    return " ".join(content.split())
+
+
+def identifiers_of(texts: Iterable[str]) -> Set[str]:
+    """Identifiers appearing in `texts`, kept as is by the normalization."""
+    names = set()
+    for text in texts:
+        if text:
+            names.update(IDENTIFIER_PATTERN.findall(str(text)))
+    return names
+
+
+def python_bound_names(content: str) -> Set[str]:
+    """Names bound by a Python answer, except the imported ones."""
+    bound, imported = set(), set()
+    for node in ast.walk(ast.parse(content)):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.alias):
+            imported.add((node.asname or node.name).split(".")[0])
+    return bound - imported
+
+
+def normalize_python(content: str, kept_names: Set[str]) -> str:
+    bound = python_bound_names(content)
+    renamed = {}
+    res = []
+    previous = None
+    for token in tokenize.generate_tokens(io.StringIO(content).readline):
+        if token.type in (tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER):
+            continue
+        if token.type == tokenize.NEWLINE:
+            res.append("\n")
+        elif token.type == tokenize.INDENT:
+            res.append("{")
+        elif token.type == tokenize.DEDENT:
+            res.append("}")
+        elif (
+            token.type == tokenize.NAME
+            and token.string in bound
+            and token.string not in PYTHON_KEPT_NAMES
+            and token.string not in kept_names
+            # Attributes, e.g. `.append`, belong to other objects
+            and not (previous is not None and previous.string == ".")
+        ):
+            res.append(renamed.setdefault(token.string, f"v{len(renamed)}"))
+        else:
+            res.append(token.string)
+        previous = token
+    return " ".join(res)
+
+
+def closes_template(tokens: List[Tuple[str, str]], end: int) -> bool:
+    """Whether the `>` (or `>>`) at `end` closes template arguments, as in `vector<int> v`."""
+    depth = 0
+    for i in range(end, 0, -1):
+        kind, text = tokens[i]
+        if text in (">", ">>"):
+            depth += len(text)
+        elif text == "<":
+            depth -= 1
+            if depth == 0:
+                return tokens[i - 1][0] == "identifier"
+        elif kind not in ("identifier", "number") and text not in ("::", ",", "*", "&"):
+            return False
+    return False
+
+
+def is_type(tokens: List[Tuple[str, str]], i: int, language: str) -> bool:
+    """Whether the token at `i` ends the type of a declaration."""
+    if i < 0:
+        return False
+    kind, text = tokens[i]
+    if kind == "identifier":
+        return text in C_LIKE_DECLARATION_KEYWORDS[language] or text not in C_LIKE_KEYWORDS[language]
+    if text in (">", ">>"):
+        return closes_template(tokens, i)
+    if text == "]":
+        # Java arrays: `int[] values`
+        return i >= 2 and tokens[i - 1][1] == "[" and is_type(tokens, i - 2, language)
+    if text in ("*", "&", "&&"):
+        # `int* p`, `vector<int>& v`, `(Point& p)`, but not `a * b`
+        if i < 1 or tokens[i - 1][1] in (">", ">>"):
+            return is_type(tokens, i - 1, language)
+        kind, text = tokens[i - 1]
+        if kind != "identifier" or text in C_LIKE_DECLARATION_KEYWORDS[language]:
+            return kind == "identifier"
+        starts = (";", "{", "}", "const") if tokens[i][1] == "*" else (";", "{", "}", "const", "(", ",")
+        return text not in C_LIKE_KEYWORDS[language] and (i < 2 or tokens[i - 2][1] in starts)
+    return False
+
+
+def parameters_between(tokens: List[Tuple[str, str]], start: int, end: int) -> Set[str]:
+    """Untyped parameters between the parentheses at `start` and `end`, e.g. `(a, b = 0)`."""
+    names = set()
+    depth = 0
+    for i in range(start, end):
+        text = tokens[i][1]
+        if text in ("(", "[", "{"):
+            depth += 1
+        elif text in (")", "]", "}"):
+            depth -= 1
+        elif depth == 1 and tokens[i][0] == "identifier" and tokens[i + 1][1] in (",", ")", "="):
+            names.add(text)
+    return names
+
+
+def matching_parenthesis(tokens: List[Tuple[str, str]], i: int, step: int) -> int:
+    """Index of the parenthesis matching the one at `i`, searching in direction `step`."""
+    depth = 0
+    while 0 <= i < len(tokens):
+        text = tokens[i][1]
+        if text == "(":
+            depth += step
+        elif text == ")":
+            depth -= step
+        if depth == 0:
+            return i
+        i += step
+    return -1
+
+
+def c_like_bound_names(tokens: List[Tuple[str, str]], language: str) -> Set[str]:
+    """Names declared by a C-like answer: variables, parameters, functions, lambda parameters."""
+    keywords = C_LIKE_KEYWORDS[language]
+    bound = set()
+    # Bracket depth of the declaration statement being read, for `int a = 0, b = 1;`
+    declaring = None
+    depth = 0
+    for i, (kind, text) in enumerate(tokens):
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if text in ("(", "[", "{"):
+            depth += 1
+        elif text in (")", "]", "}"):
+            depth -= 1
+        if text == ";" or (declaring is not None and depth < declaring):
+            declaring = None
+
+        if kind == "identifier" and text not in keywords and following in C_LIKE_DECLARATION_ENDS:
+            if is_type(tokens, i - 1, language):
+                bound.add(text)
+                declaring = depth
+            elif declaring == depth and i > 0 and tokens[i - 1][1] == ",":
+                bound.add(text)
+        elif text == "function" and language == "javascript":
+            start = i + 2 if following not in (None, "(") else i + 1
+            if start < len(tokens) and tokens[start][1] == "(":
+                bound |= parameters_between(tokens, start, matching_parenthesis(tokens, start, 1))
+        elif (text == "=>" and language == "javascript") or (text == "->" and language == "java"):
+            if i > 0 and tokens[i - 1][0] == "identifier":
+                bound.add(tokens[i - 1][1])
+            elif i > 0 and tokens[i - 1][1] == ")":
+                start = matching_parenthesis(tokens, i - 1, -1)
+                if start >= 0:
+                    bound |= parameters_between(tokens, start, i - 1)
+        elif text == "catch" and following == "(" and language == "javascript":
+            bound |= parameters_between(tokens, i + 1, matching_parenthesis(tokens, i + 1, 1))
+    return bound - keywords
+
+
+def normalize_c_like(content: str, language: str, kept_names: Set[str]) -> str:
+    tokens = [
+        (match.lastgroup, match.group())
+        for match in C_LIKE_TOKEN_PATTERN.finditer(content)
+        if match.lastgroup not in ("comment", "space")
+    ]
+    bound = c_like_bound_names(tokens, language)
+    renamed = {}
+    res = []
+    previous = None
+    for kind, text in tokens:
+        if (
+            kind == "identifier"
+            and text in bound
+            and text not in kept_names
+            and previous not in (".", "->", "::")
+        ):
+            text = renamed.setdefault(text, f"v{len(renamed)}")
+        res.append(text)
+        previous = text
+    return " ".join(res)
+
+
+def normalize_answer(content: str, question_type: str, kept_names: Set[str] = frozenset()) -> str:
+    """Normalize an answer according to the type of its question."""
+    content = content or ""
+    if not content.strip():
+        return ""
+    try:
+        if question_type == "python":
+            return normalize_python(content, kept_names)
+        if question_type in C_LIKE_KEYWORDS:
+            return normalize_c_like(content, question_type, kept_names)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        pass
+    return normalize_whitespace(content)
+
+
+def question_kept_names(question: dict) -> Set[str]:
+    if question.get("type") not in CODE_TYPES:
+        return set()
+    return identifiers_of(
+        [question.get("description"), question.get("solution"), question.get("unit_tests")]
+    )
+
+
+def answer_fingerprint(content: str, question: dict, kept_names: Set[str] = None) -> str:
+    """Fingerprint of an answer to `question`, equal for equivalent answers.
+
+    Args:
+        content: The answer
+        question: The question (`id` and `type` are used)
+        kept_names: Identifiers not to rename, defaults to `question_kept_names(question)`
+    """
+    if kept_names is None:
+        kept_names = question_kept_names(question)
+    normalized = normalize_answer(content, question.get("type", "open"), kept_names)
+    key = f"{question.get('id')}\0{normalized}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
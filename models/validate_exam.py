@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Validate exam files against `schema.yaml`.
+
+The schema is compiled once, then the exam is validated piece by piece: the
+header fields, each question, and each student (read lazily from a sharded
+exam, see `exam_store.py`). Every error is reported, with the line number of
+the offending value in the YAML file.
+
+On top of the schema, the question ids must be unique, and every answer must
+refer to an existing question, at most once per student.
+
+Usage:
+    python validate_exam.py <exam_filepath>
+
+Arguments:
+    exam_filepath    Path to the exam YAML file, or to a sharded exam folder
+
+Exit code:
+    0 if the exam is valid, 1 otherwise (the errors are printed one per line)
+"""
+
+import argparse
+import copy
+import sys
+from dataclasses import dataclass
+from datetime import date as Date
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from jsonschema import Draft7Validator
+from ruamel.yaml import YAML
+
+import exam_store
+
+
+SCHEMA_FILEPATH = Path(__file__).resolve().parent / "schema.yaml"
+
+
+@dataclass
+class ValidationIssue:
+    filepath: str
+    line: Optional[int]
+    path: str
+    message: str
+
+    def __str__(self):
+        location = self.filepath if self.line is None else f"{self.filepath}:{self.line}"
+        return f"{location}: {self.path}: {self.message}"
+
+
+@lru_cache(maxsize=None)
+def get_validators():
+    """Compile the schema once.
+
+    Returns:
+        Tuple (header, question, student) validators. The header validator
+        checks the exam without looking inside the questions and students.
+    """
+    schema = YAML(typ="safe").load(SCHEMA_FILEPATH)
+    Draft7Validator.check_schema(schema)
+
+    header_schema = copy.deepcopy(schema)
+    header_schema["properties"]["questions"] = {"type": "array"}
+    header_schema["properties"]["student_response"] = {"type": ["array", "null"]}
+
+    return (
+        Draft7Validator(header_schema),
+        Draft7Validator(schema["properties"]["questions"]["items"]),
+        Draft7Validator(schema["properties"]["student_response"]["items"]),
+    )
+
+
+def line_of(node, path) -> Optional[int]:
+    """Line number (1-indexed) of the value at `path` in a ruamel round-trip node.
+
+    The deepest node of the path with a known position is used.
+    """
+    line = None
+    if hasattr(node, "lc"):
+        line = node.lc.line
+    for key in path:
+        try:
+            if isinstance(node, dict):
+                line = node.lc.key(key)[0]
+            else:
+                line = node.lc.item(key)[0]
+            node = node[key]
+        except (AttributeError, KeyError, IndexError, TypeError):
+            break
+    return None if line is None else line + 1
+
+
+def format_path(prefix: str, path) -> str:
+    res = prefix
+    for key in path:
+        if isinstance(key, int):
+            res += f"[{key}]"
+        else:
+            res += f".{key}" if res else str(key)
+    return res or "exam"
+
+
+def check(validator, instance, filepath, prefix, node=None) -> Iterator[ValidationIssue]:
+    """Validate `instance`, looking the line numbers up in `node` (defaults to `instance`)."""
+    node = instance if node is None else node
+    for error in validator.iter_errors(instance):
+        yield ValidationIssue(
+            filepath=str(filepath),
+            line=line_of(node, error.absolute_path),
+            path=format_path(prefix, error.absolute_path),
+            message=error.message,
+        )
+
+
+def student_issues(student, filepath, prefix, question_ids) -> Iterator[ValidationIssue]:
+    _, _, student_validator = get_validators()
+    yield from check(student_validator, student, filepath, prefix)
+
+    if not isinstance(student, dict) or not isinstance(student.get("answers"), list):
+        return
+
+    answered = set()
+    for i, answer in enumerate(student["answers"]):
+        if not isinstance(answer, dict) or "question_id" not in answer:
+            continue
+        question_id = answer["question_id"]
+        message = None
+        if question_id not in question_ids:
+            message = f"Answer to unknown question {question_id}"
+        elif question_id in answered:
+            message = f"Several answers to question {question_id}"
+        answered.add(question_id)
+        if message:
+            yield ValidationIssue(
+                filepath=str(filepath),
+                line=line_of(student, ["answers", i, "question_id"]),
+                path=format_path(prefix, ["answers", i, "question_id"]),
+                message=message,
+            )
+
+
+def iter_issues(exam_path) -> Iterator[ValidationIssue]:
+    """Validate an exam, yielding every issue found.
+
+    Args:
+        exam_path: Path to the exam YAML file, or to a sharded exam folder
+    """
+    exam_path = Path(exam_path)
+    header_validator, question_validator, _ = get_validators()
+    sharded = exam_store.is_sharded(exam_path)
+
+    if sharded:
+        header_filepath = exam_path / exam_store.HEADER_FILENAME
+        data = exam_store.load_header(exam_path)
+    else:
+        header_filepath = exam_path
+        data = exam_store.load_yaml_file(exam_path, cached=True)
+
+    if not isinstance(data, dict):
+        yield ValidationIssue(str(header_filepath), None, "exam", "The exam is not a mapping")
+        return
+
+    header = dict(data)
+    header["questions"] = data.get("questions")
+    if isinstance(header.get("exam_date"), Date):
+        header["exam_date"] = header["exam_date"].isoformat()
+    yield from check(header_validator, header, header_filepath, "", node=data)
+
+    questions = data.get("questions") if isinstance(data.get("questions"), list) else []
+    question_ids = set()
+    for i, question in enumerate(questions):
+        prefix = f"questions[{i}]"
+        for issue in check(question_validator, question, header_filepath, prefix):
+            issue.line = issue.line or line_of(questions, [i])
+            yield issue
+        if isinstance(question, dict) and "id" in question:
+            if question["id"] in question_ids:
+                yield ValidationIssue(
+                    filepath=str(header_filepath),
+                    line=line_of(question, ["id"]),
+                    path=f"{prefix}.id",
+                    message=f"Duplicate question id {question['id']}",
+                )
+            question_ids.add(question["id"])
+
+    if sharded:
+        for student_filepath in exam_store.student_files(exam_path):
+            student = exam_store.load_yaml_file(student_filepath)
+            yield from student_issues(student, student_filepath, "", question_ids)
+    else:
+        students = data.get("student_response")
+        for i, student in enumerate(students if isinstance(students, list) else []):
+            for issue in student_issues(
+                student, header_filepath, f"student_response[{i}]", question_ids
+            ):
+                issue.line = issue.line or line_of(students, [i])
+                yield issue
+
+
+def validate_exam(exam_path) -> List[ValidationIssue]:
+    """Validate an exam.
+
+    Returns:
+        The list of issues found, empty if the exam is valid
+    """
+    return list(iter_issues(exam_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate an exam file against schema.yaml")
+    parser.add_argument("exam_filepath", help="Exam YAML file path, or sharded exam folder")
+    args = parser.parse_args()
+
+    issues = 0
+    for issue in iter_issues(args.exam_filepath):
+        issues += 1
+        print(issue)
+
+    if issues:
+        print(f"{issues} error(s) found")
+        sys.exit(1)
+    print("The exam is valid")
+
+
+if __name__ == "__main__":
+    main()
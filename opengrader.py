@@ -1,14 +1,33 @@
 # OpenGrader agent using LangGraph deep agents with skills for exam grading
 
+import asyncio
 import sys
 import os
 from pathlib import Path
 from deepagents import create_deep_agent
 from deepagents.backends.filesystem import FilesystemBackend
+from deepagents.middleware import SummarizationMiddleware
+from langchain.agents.middleware import ClearToolUsesEdit, ContextEditingMiddleware
 from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langchain_core.messages import AIMessage, ToolMessage
 from langchain_litellm import ChatLiteLLM
 import sqlite3
-from utils import ProgressSpinner, setup_logging, log_thought_signatures, log_agent_state, print_logo, print_agent
+import aiosqlite
+from llm_cache import get_llm_cache
+from utils import (
+    ProgressSpinner, setup_logging, log_thought_signatures, log_agent_state, print_logo,
+    summarize_token_usage, estimate_cache_savings, print_usage, StreamPrinter,
+)
+
+
+# Token budget of the conversation sent to the model (see `_build_compaction_middleware`)
+DEFAULT_CONTEXT_BUDGET = 60_000
+
+CLEARED_TOOL_OUTPUT = (
+    "[Output cleared to save context. Files read or written earlier are still on disk, "
+    "read them again if needed.]"
+)
 
 
 class OpenGraderAgent:
@@ -21,6 +40,9 @@ class OpenGraderAgent:
         self,
         working_dir: str,
         skills_dir: str = None,
+        use_cache: bool = True,
+        context_budget: int = None,
+        database_path: str = "opengrader.db",
     ):
         """
         Initialize the OpenGrader agent.
@@ -28,6 +50,12 @@ class OpenGraderAgent:
         Args:
             working_dir: Directory where exam files are located (teacher's workspace)
             skills_dir: Path to skills directory (defaults to ./skills)
+            use_cache: Reuse the LLM responses cached on disk for identical requests
+                (also disabled by OPENGRADER_NO_LLM_CACHE=1)
+            context_budget: Token budget of the conversation sent to the model, older
+                turns are compacted beyond it (defaults to OPENGRADER_CONTEXT_BUDGET,
+                or 60000)
+            database_path: SQLite database of the conversation checkpoints
         """
         self.working_dir = Path(working_dir).resolve()
         
@@ -45,35 +73,94 @@ class OpenGraderAgent:
         assert os.path.exists(self.skills_dir), f"Skills directory {self.skills_dir} does not exist"
                 
         # LiteLLM loads OPENROUTER_API_KEY from .env automatically.
-        model_name = os.getenv("OPENGRADER_MODEL", "openrouter/google/gemini-3-flash-preview")
+        self.model_name = os.getenv("OPENGRADER_MODEL", "openrouter/google/gemini-3-flash-preview")
         self.model = ChatLiteLLM(
-            model=model_name,
+            model=self.model_name,
             temperature=0.7,
+            cache=get_llm_cache(use_cache),
+            # The system prompt is the same for every call: mark it as a prompt cache
+            # breakpoint for the providers that need one (Anthropic), the others
+            # cache stable prefixes on their own
+            model_kwargs={
+                "cache_control_injection_points": [{"location": "message", "role": "system"}],
+            },
         )
         
-        # Create SQLite checkpointer
-        conn = sqlite3.connect("opengrader.db", check_same_thread=False)
-        self.checkpointer = SqliteSaver(conn)
+        # System context for the agent, sent once as the system prompt
+        self.system_context = self._build_system_context()
+        # Token usage of the last turn (see `summarize_token_usage`)
+        self.last_usage = None
         
-        # Create the agent
-        self.agent = create_deep_agent(
-            backend=FilesystemBackend(root_dir=str(self.working_dir)),
+        if context_budget is None:
+            context_budget = int(os.getenv("OPENGRADER_CONTEXT_BUDGET", DEFAULT_CONTEXT_BUDGET))
+        self.context_budget = context_budget
+        
+        self.database_path = database_path
+        self._setup_agent()
+    
+    def _setup_agent(self):
+        """Create the SQLite checkpointer and the agent."""
+        conn = sqlite3.connect(self.database_path, check_same_thread=False)
+        self.checkpointer = SqliteSaver(conn)
+        self.agent = self._create_agent(self.checkpointer)
+    
+    def _create_agent(self, checkpointer):
+        """Create the deep agent, saving its threads with `checkpointer`."""
+        backend = FilesystemBackend(root_dir=str(self.working_dir))
+        return create_deep_agent(
+            backend=backend,
             skills=[str(self.skills_dir) + "/"],
-            checkpointer=self.checkpointer,
+            checkpointer=checkpointer,
             interrupt_on={
                 "write_file": True,   # Always confirm file writes
                 "read_file": False,   # No interrupts for reads
                 "edit_file": True,    # Confirm file edits
             },
             model=self.model,
+            system_prompt=self.system_context,
+            middleware=self._build_compaction_middleware(backend),
         )
+    
+    def _build_compaction_middleware(self, backend) -> list:
+        """
+        Keep the conversation sent to the model within `self.context_budget` tokens.
         
-        # System context for the agent
-        self.system_context = self._build_system_context()
+        The checkpointed thread keeps every message, but the model only sees:
+        - Past half of the budget, the old tool outputs (mostly file contents, which
+          are on disk anyway) are replaced by a placeholder, except the 3 latest ones
+        - Past the budget, the old turns are replaced by a summary (the full history
+          is saved by deep agents under /conversation_history/ in the working directory)
+        """
+        budget = self.context_budget
+        return [
+            # Replaces the default summarization of deep agents, which only triggers
+            # at 170k tokens for models without a known context size
+            SummarizationMiddleware(
+                self.model,
+                backend=backend,
+                trigger=("tokens", budget),
+                keep=("tokens", budget // 4),
+                truncate_args_settings={
+                    # Large write_file / edit_file arguments (e.g. a whole exam YAML)
+                    "trigger": ("tokens", budget // 2),
+                    "keep": ("messages", 20),
+                },
+            ),
+            ContextEditingMiddleware(
+                edits=[
+                    ClearToolUsesEdit(
+                        trigger=budget // 2,
+                        keep=3,
+                        clear_tool_inputs=True,
+                        placeholder=CLEARED_TOOL_OUTPUT,
+                    ),
+                ],
+            ),
+        ]
     
     def _build_system_context(self) -> str:
         """Build system context with conventions and workflow."""
-        return """You are OpenGrader, an AI assistant for grading exams.
+        return f"""You are OpenGrader, an AI assistant for grading exams.
 
 ## Your Role
 You help teachers grade exams through a conversational, step-by-step process. 
@@ -90,6 +177,8 @@ You have access to skills that help with specific tasks like extracting question
 3. **Rubric**: Create or import grading rubric
 4. **Grade**: Grade student answers using the rubric
 
+For programming questions with unit test results, the failing answers sharing a `unit_test_results.cluster` fail the same tests for the same reason: grade the `representative` of each cluster, and propose to apply its grade to the whole cluster.
+
 ## Human-in-the-Loop Philosophy
 - Always confirm before major operations (creating files, grading, etc.)
 - Present options and let the teacher choose the next step
@@ -108,13 +197,15 @@ When starting a new grading session, use the inventory skill to:
 4. Present workflow options (create rubric, grade with/without rubric, import rubric)
 """
     
-    def chat(self, message: str, thread_id: str = "default") -> str:
+    def chat(self, message: str, thread_id: str = "default", stream: bool = False) -> str:
         """
         Send a message to the agent and get a response.
         
         Args:
             message: User message
             thread_id: Conversation thread ID (for maintaining context across sessions)
+            stream: Print the response tokens and the tool calls as they arrive,
+                instead of showing a spinner until the end of the turn
             
         Returns:
             Agent's response
@@ -123,51 +214,29 @@ When starting a new grading session, use the inventory skill to:
         self.logger.info(f"User message (thread: {thread_id}): {message}")
         self.logger.info("="*80)
         
-        # Add system context to first message if needed
-        full_message = f"{self.system_context}\n\nUser: {message}"
-        
-        self.logger.debug(f"Full message with context: {full_message}...")
+        inputs = {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": message,
+                }
+            ]
+        }
+        config = {"configurable": {"thread_id": thread_id}}
         
-        progress_spinner = ProgressSpinner("Thinking")
-        progress_spinner.start()
+        progress_spinner = None
+        if not stream:
+            progress_spinner = ProgressSpinner("Thinking")
+            progress_spinner.start()
         
         try:
-            result = self.agent.invoke(
-                {
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": full_message,
-                        }
-                    ]
-                },
-                config={"configurable": {"thread_id": thread_id}},
-            )
+            if stream:
+                result = self._stream_turn(inputs, config)
+            else:
+                result = self.agent.invoke(inputs, config=config)
             
             self.logger.debug("Agent invocation completed")
-            
-            # Log detailed agent state
-            log_agent_state(self.logger, result)
-            
-            # Extract the last message from the agent
-            if result and "messages" in result:
-                last_message = result["messages"][-1]
-                
-                # Log thought signatures if present
-                log_thought_signatures(self.logger, last_message)
-                
-                if hasattr(last_message, "content"):
-                    response_content = last_message.content
-                    # Log full response to DEBUG only
-                    self.logger.debug(f"Full agent response: {response_content}")
-                    return response_content
-                
-                response_str = str(last_message)
-                self.logger.debug(f"Agent response (str): {response_str}")
-                return response_str
-            
-            self.logger.warning("No messages in agent result")
-            return "No response from agent"
+            return self._response_from_result(result)
         
         except Exception as e:
             self.logger.error(f"Error during chat: {e}", exc_info=True)
@@ -177,12 +246,83 @@ When starting a new grading session, use the inventory skill to:
             if progress_spinner:
                 progress_spinner.stop()
     
-    def start_session(self, thread_id: str = "default") -> str:
+    def _response_from_result(self, result) -> str:
+        """Log the state at the end of a turn, and extract the response of the agent."""
+        # Log detailed agent state
+        log_agent_state(self.logger, result)
+        
+        # Extract the last message from the agent
+        if result and "messages" in result:
+            self._record_usage(result["messages"])
+            last_message = result["messages"][-1]
+            
+            # Log thought signatures if present
+            log_thought_signatures(self.logger, last_message)
+            
+            if hasattr(last_message, "content"):
+                response_content = last_message.content
+                # Log full response to DEBUG only
+                self.logger.debug(f"Full agent response: {response_content}")
+                return response_content
+            
+            response_str = str(last_message)
+            self.logger.debug(f"Agent response (str): {response_str}")
+            return response_str
+        
+        self.logger.warning("No messages in agent result")
+        return "No response from agent"
+    
+    def _stream_turn(self, inputs: dict, config: dict) -> dict:
+        """
+        Run one turn with the graph stream API, printing its progress.
+        
+        Returns:
+            The state of the thread at the end of the turn, like `invoke`
+        """
+        printer = StreamPrinter()
+        try:
+            for mode, data in self.agent.stream(inputs, config=config, stream_mode=["messages", "updates"]):
+                if mode == "messages":
+                    chunk, metadata = data
+                    # Skip the internal model calls of the middleware (e.g. summaries)
+                    if metadata.get("langgraph_node") != "model" or metadata.get("lc_source"):
+                        continue
+                    if metadata.get("lc_internal_call") or not isinstance(chunk, AIMessage):
+                        continue
+                    printer.token(chunk.text)
+                else:
+                    for node, update in data.items():
+                        if not isinstance(update, dict):
+                            continue
+                        for msg in update.get("messages", []):
+                            if node == "model":
+                                for tool_call in getattr(msg, "tool_calls", None) or []:
+                                    printer.tool_call(tool_call["name"], tool_call.get("args") or {})
+                            elif node == "tools" and isinstance(msg, ToolMessage):
+                                printer.tool_result(msg.name, msg.status == "error")
+        finally:
+            printer.end()
+        
+        return self.agent.get_state(config).values
+    
+    def _record_usage(self, messages):
+        """Compute the token usage of the turn that just ended."""
+        # The turn starts after the last user message
+        start = 0
+        for idx, msg in enumerate(messages):
+            if getattr(msg, "type", None) == "human":
+                start = idx + 1
+        self.last_usage = summarize_token_usage(messages[start:])
+        self.last_usage["savings"] = estimate_cache_savings(self.model_name, self.last_usage)
+        self.logger.info(f"Turn token usage: {self.last_usage}")
+    
+    def start_session(self, thread_id: str = "default", stream: bool = False) -> str:
         """
         Start a new grading session with inventory check.
         
         Args:
             thread_id: Conversation thread ID
+            stream: Print the response as it arrives (see `chat`)
             
         Returns:
             Initial agent response with inventory
@@ -190,10 +330,103 @@ When starting a new grading session, use the inventory skill to:
         self.logger.info(f"Starting new grading session (thread: {thread_id})")
         return self.chat(
             "I'm ready to start grading.",
-            thread_id=thread_id
+            thread_id=thread_id,
+            stream=stream,
         )
 
 
+class AsyncOpenGraderAgent(OpenGraderAgent):
+    """
+    Asynchronous OpenGrader agent, to serve many grading sessions from one process.
+    
+    Sessions are independent threads (`thread_id`) of the same agent: they share
+    the model and an async SQLite checkpointer, and run concurrently on the event
+    loop. The checkpointer needs the running loop, so it is created on first use.
+    
+    Example:
+        async with AsyncOpenGraderAgent(working_dir) as agent:
+            await asyncio.gather(
+                agent.start_session(thread_id="teacher-1"),
+                agent.start_session(thread_id="teacher-2"),
+            )
+    """
+    
+    def _setup_agent(self):
+        self.checkpointer = None
+        self.agent = None
+        self._conn = None
+        self._setup_lock = None
+        # Token usage of the last turn of each thread
+        self.usage_by_thread = {}
+    
+    async def _ensure_agent(self):
+        """Create the async checkpointer and the agent, once."""
+        if self._setup_lock is None:
+            self._setup_lock = asyncio.Lock()
+        async with self._setup_lock:
+            if self.agent is None:
+                self._conn = await aiosqlite.connect(self.database_path)
+                self.checkpointer = AsyncSqliteSaver(self._conn)
+                self.agent = self._create_agent(self.checkpointer)
+    
+    async def chat(self, message: str, thread_id: str = "default") -> str:
+        """
+        Send a message to the agent and get a response.
+        
+        Args:
+            message: User message
+            thread_id: Conversation thread ID, turns of different threads can run concurrently
+            
+        Returns:
+            Agent's response
+        """
+        await self._ensure_agent()
+        self.logger.info(f"User message (thread: {thread_id}): {message}")
+        
+        try:
+            result = await self.agent.ainvoke(
+                {"messages": [{"role": "user", "content": message}]},
+                config={"configurable": {"thread_id": thread_id}},
+            )
+            self.logger.debug(f"Agent invocation completed (thread: {thread_id})")
+            response = self._response_from_result(result)
+            # Concurrent sessions overwrite `last_usage`, keep the usage by thread too
+            self.usage_by_thread[thread_id] = self.last_usage
+            return response
+        
+        except Exception as e:
+            self.logger.error(f"Error during chat (thread: {thread_id}): {e}", exc_info=True)
+            raise
+    
+    async def start_session(self, thread_id: str = "default") -> str:
+        """
+        Start a new grading session with inventory check.
+        
+        Args:
+            thread_id: Conversation thread ID
+            
+        Returns:
+            Initial agent response with inventory
+        """
+        self.logger.info(f"Starting new grading session (thread: {thread_id})")
+        return await self.chat("I'm ready to start grading.", thread_id=thread_id)
+    
+    async def aclose(self):
+        """Close the SQLite connection."""
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+            self.agent = None
+            self.checkpointer = None
+    
+    async def __aenter__(self):
+        await self._ensure_agent()
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
 def main():
     """Example usage of OpenGrader agent."""
     
@@ -210,8 +443,10 @@ def main():
     agent = OpenGraderAgent(working_dir=str(working_dir))
     # Start interactive session
     thread_id = "demo"
-    response = agent.start_session(thread_id=thread_id)
-    print_agent(response)
+    # The responses are printed while streamed
+    agent.start_session(thread_id=thread_id, stream=True)
+    if agent.last_usage:
+        print_usage(agent.last_usage, agent.last_usage["savings"])
     print("-" * 60)
     
     # Interactive agent loop
@@ -222,9 +457,10 @@ def main():
                 print("Goodbye!")
                 break
             
-            response = agent.chat(user_input, thread_id=thread_id)
             print()
-            print_agent(response)
+            agent.chat(user_input, thread_id=thread_id, stream=True)
+            if agent.last_usage:
+                print_usage(agent.last_usage, agent.last_usage["savings"])
             print("-" * 60)
             
         except KeyboardInterrupt:
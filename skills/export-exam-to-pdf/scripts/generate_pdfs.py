@@ -1,17 +1,42 @@
 import argparse
 import glob
+import hashlib
 import os
+import re
 import shutil
 import subprocess
+import sys
+import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from dataclasses import dataclass
 from datetime import date as Date
+from functools import lru_cache
 from os import mkdir, path
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
 from pypdf import PdfReader
-from ruamel.yaml import YAML
+
+# The exam templates are looked up in the assets of the skill, whatever the cwd
+TEMPLATES_FOLDER = path.join(path.dirname(path.realpath(__file__)), "..", "assets")
+# Shared exam modules also live in the assets of the skill
+sys.path.insert(0, TEMPLATES_FOLDER)
+
+import exam_store
+from validate_exam import validate_exam
+
+# Markers written by the template when `add_anchors` is set (e.g. "Q3:start").
+# They are PDF named destinations (`\hypertarget`), not text: they record the
+# page of every question without changing what is printed or extracted.
+ANCHOR_PATTERN = re.compile(r"Q(\d+):(start|end)")
+
+# Size of the rendered PDFs cache of an output folder, in MB
+DEFAULT_CACHE_SIZE = 512
+
+TEMPLATES_CACHE_FOLDER = path.join(
+    os.environ.get("XDG_CACHE_HOME", path.expanduser("~/.cache")), "opengrader", "jinja2"
+)
 
 
 @dataclass
@@ -22,14 +47,27 @@ class Answer:
     correction_details: Optional[str]
 
 
-@dataclass
+@dataclass(frozen=True)
 class Question:
     id: int
     name: str
     description: str
     type: str
-    linebreak: int
+
+
+@dataclass
+class FilledQuestion:
+    """A question of one student's exam: the shared question and its answer."""
+
+    question: Question
     answer: Optional[Answer]
+    linebreak: int = 0
+
+    def __getattr__(self, name):
+        # The question fields (name, description...) are read from the shared question
+        if name == "question":
+            raise AttributeError(name)
+        return getattr(self.question, name)
 
 
 @dataclass
@@ -38,63 +76,146 @@ class Exam:
     date: Date
     questions: List[Question]
     authors: List[str]
-    add_anchors: bool
+    question_index: dict[int, Question]
+    diagnostics: List[str]
 
     def __init__(self, data):
         self.name = data["exam_name"]
         self.date = data["exam_date"]
         self.authors = data["authors"]
         self.questions = []
+        self.question_index = {}
+        self.diagnostics = []
         for q in data["questions"]:
-            self.questions.append(
-                Question(
-                    id=q["id"],
-                    name=q["name"],
-                    description=q["description"],
-                    type=q["type"],
-                    answer=None,
-                    linebreak=0,
-                )
+            question = Question(
+                id=q["id"],
+                name=q["name"],
+                description=q["description"],
+                type=q["type"],
             )
+            if question.id in self.question_index:
+                self.diagnostics.append(f"Duplicate question id {question.id}")
+            self.questions.append(question)
+            self.question_index[question.id] = question
 
 
 @dataclass
-class FilledExam(Exam):
+class FilledExam:
+    exam: Exam
     firstname: str
     lastname: str
+    questions: List[FilledQuestion]
+    add_anchors: bool
+    diagnostics: List[str]
 
     def __init__(
-        self, data, firstname: str, lastname: str, answers: List[Answer]
+        self, exam: Exam, firstname: str, lastname: str, answers: List[Answer]
     ):
-        super().__init__(data)
+        self.exam = exam
         self.firstname = firstname
         self.lastname = lastname
-        for q in self.questions:
-            for a in answers:
-                if a.question_id == q.id:
-                    q.answer = a
+        self.add_anchors = False
+        self.diagnostics = []
+
+        answer_index = {}
+        for a in answers:
+            if a.question_id not in exam.question_index:
+                self.diagnostics.append(
+                    f"Answer to unknown question {a.question_id} is ignored"
+                )
+                continue
+            if a.question_id in answer_index:
+                self.diagnostics.append(
+                    f"Several answers to question {a.question_id}, the last one is used"
+                )
+            answer_index[a.question_id] = a
 
-    @staticmethod
-    def from_yaml(data, add_anchors=False):
-        res = [
-            FilledExam(
-                data, firstname="Template", lastname="Template", answers=[]
-            )
+        self.questions = [
+            FilledQuestion(question=q, answer=answer_index.get(q.id))
+            for q in exam.questions
         ]
-        data["add_anchors"] = add_anchors
-        for s in data["student_response"]:
+
+    def __getattr__(self, name):
+        # The exam fields (name, date, authors) are read from the shared exam
+        if name == "exam":
+            raise AttributeError(name)
+        return getattr(self.exam, name)
+
+    @staticmethod
+    def iter_yaml(
+        data, exam: Optional[Exam] = None, students: Optional[Iterable[dict]] = None
+    ) -> Iterator["FilledExam"]:
+        """Lazily build the template exam, then the exam of every student.
+
+        The questions are parsed once (or taken from `exam`) and shared by all
+        the exams. The students are taken from `students` if given (e.g. read
+        lazily from a sharded exam), from `data["student_response"]` otherwise.
+        """
+        exam = exam or Exam(data)
+        if students is None:
+            students = data["student_response"]
+        yield FilledExam(exam, firstname="Template", lastname="Template", answers=[])
+        for s in students:
             answers = []
             for a in s["answers"]:
                 answers.append(Answer(**a))
-            res.append(
-                FilledExam(
-                    data=data,
-                    firstname=s["firstname"],
-                    lastname=s["lastname"],
-                    answers=answers,
-                )
+            yield FilledExam(
+                exam,
+                firstname=s["firstname"],
+                lastname=s["lastname"],
+                answers=answers,
             )
-        return res
+
+    @staticmethod
+    def from_yaml(data):
+        return list(FilledExam.iter_yaml(data))
+
+
+class ExamCohort:
+    """Exams of a parsed exam YAML, built on the fly each time they are iterated.
+
+    Unlike a list of `FilledExam`, iterating the cohort several times (once per
+    rendering pass) never holds more than one student's exam in memory.
+    For a sharded exam, the students files are also only read while iterating.
+    """
+
+    def __init__(self, data, exam_path: Optional[str] = None):
+        self.data = data
+        self.exam = Exam(data)
+        self.exam_path = exam_path
+
+    def __iter__(self) -> Iterator[FilledExam]:
+        students = None
+        if self.exam_path is not None:
+            students = exam_store.iter_students(self.exam_path)
+        return FilledExam.iter_yaml(self.data, self.exam, students)
+
+    def __len__(self):
+        if self.exam_path is not None:
+            return exam_store.count_students(self.exam_path) + 1
+        return len(self.data["student_response"]) + 1
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str = "template.jinja2") -> Template:
+    """Load and compile an exam template once per process.
+
+    The compiled templates are also kept in a bytecode cache on disk, so that
+    later invocations of the script skip the compilation.
+
+    Args:
+        name: File name of the template in the `assets/` folder of the skill
+
+    Returns:
+        The compiled template, whose `render` is reused for every exam
+
+    """
+    os.makedirs(TEMPLATES_CACHE_FOLDER, exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATES_FOLDER),
+        bytecode_cache=FileSystemBytecodeCache(TEMPLATES_CACHE_FOLDER),
+    )
+    return env.get_template(name)
 
 
 def find_questions_in_pdfs(folder_path: str) -> dict[str, dict[int, int]]:
@@ -121,120 +242,361 @@ def find_questions_in_pdfs(folder_path: str) -> dict[str, dict[int, int]]:
 def find_questions_in_pdf(pdf_path: str) -> dict[int, int]:
     """Find question markers (Q0, Q1, Q2...) in a single PDF.
 
+    The `Qn:start` / `Qn:end` markers are read from the named destinations of
+    the PDF, without extracting the text of its pages.
+
     Args:
         pdf_path: Path to PDF file
 
     Returns:
-        Dict mapping question number -> page number (1-indexed)
-        Example: {0: 1, 1: 3, 2: 5}
+        Dict mapping question number -> number of pages spanned by the question
+        Example: {0: 0, 1: 2, 2: 1}
 
     """
-    questions = {}
     reader = PdfReader(pdf_path)
 
-    q_num = 0
+    starts = {}
+    ends = {}
 
-    # We loop until no more question are found
-    while True:
-        q_num += 1
-        pattern_start = f"Q{q_num}:start"
-        pattern_end = f"Q{q_num}:end"
-        page_num_start = None
-        page_num_end = None
+    for name, destination in reader.named_destinations.items():
+        match = ANCHOR_PATTERN.fullmatch(name)
+        if not match:
+            continue
+        page = reader.get_destination_page_number(destination)
+        if page is None:
+            continue
+        markers = starts if match.group(2) == "start" else ends
+        markers[int(match.group(1))] = page
 
-        for idx, page in enumerate(reader.pages):
-            text = page.extract_text()
-            if text and pattern_start in text:
-                page_num_start = idx
+    # A question without both markers is left out, and reported by the caller
+    questions = {}
+    for q_num in sorted(starts):
+        if q_num in ends:
+            questions[q_num] = ends[q_num] - starts[q_num]
 
-            if text and pattern_end in text:
-                page_num_end = idx
+    return questions
 
-            if page_num_start is not None and page_num_end is not None:
-                break
 
-        if page_num_start is not None:
-            assert page_num_end is not None
-            questions[q_num] = page_num_end - page_num_start
-        else:
-            break  # no more questions found
+def toolchain_version() -> str:
+    """Identify the pandoc toolchain used to render the PDFs.
 
-    return questions
+    Returns:
+        A string changing whenever `isc-build-pandoc` or `pandoc` is updated
 
+    """
+    parts = []
+    executable = shutil.which("isc-build-pandoc")
+    if executable:
+        parts.append(f"{executable}:{os.stat(executable).st_mtime_ns}")
+    try:
+        result = subprocess.run(
+            ["pandoc", "--version"], capture_output=True, text=True, check=True
+        )
+        parts.append(result.stdout.splitlines()[0])
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return "\n".join(parts)
+
+
+def cache_key(content: str, toolchain: str) -> str:
+    """Content address of a rendered PDF: hash of the markdown and the toolchain."""
+    digest = hashlib.sha256()
+    digest.update(toolchain.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content.encode("utf-8"))
+    return digest.hexdigest()
 
-def generate_exam(data: List[FilledExam], output_folder):
-    env = Environment(loader=FileSystemLoader("."))
-    template = env.get_template("./models/template.jinja2")
 
+def render_pdf(
+    content: str, base: str, working_folder: str, cached_pdf: Optional[str] = None
+) -> str:
+    """Render a markdown document to PDF with `isc-build-pandoc`.
+
+    Args:
+        content: Markdown content rendered from the exam template
+        base: Base name (without extension) of the generated files
+        working_folder: Folder in which pandoc is run
+        cached_pdf: Path of the cache entry for this content. If it exists, it
+            is used instead of running pandoc, otherwise it is created.
+
+    Returns:
+        Path of the generated PDF file
+
+    """
+    pdf_filepath = path.join(working_folder, base + ".pdf")
+
+    if cached_pdf and path.exists(cached_pdf):
+        shutil.copyfile(cached_pdf, pdf_filepath)
+        # Most recently used entry, evicted last (see `evict_cache`)
+        os.utime(cached_pdf)
+        return pdf_filepath
+
+    markdown_filename = base + ".md"
+    markdown_filepath = path.join(working_folder, markdown_filename)
+
+    with open(markdown_filepath, "w") as f:
+        f.write(content)
+
+    try:
+        subprocess.run(
+            ["isc-build-pandoc", "-i", markdown_filename],
+            cwd=working_folder,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"isc-build-pandoc failed: {e.stderr.strip()}") from e
+
+    if cached_pdf:
+        # Copy then rename, so that an interrupted run never leaves a partial entry
+        tmp_filepath = f"{cached_pdf}.{os.getpid()}.tmp"
+        shutil.copyfile(pdf_filepath, tmp_filepath)
+        os.replace(tmp_filepath, cached_pdf)
+
+    return pdf_filepath
+
+
+def evict_cache(cache_folder: str, max_size: int = DEFAULT_CACHE_SIZE) -> int:
+    """Remove the least recently used PDFs of a cache folder until it fits in `max_size` MB.
+
+    The entries are shared by all the exams exported to the same folder, so
+    they are evicted by last use, not by export.
+
+    Returns:
+        Number of entries removed
+    """
+    entries = []
+    for entry in os.scandir(cache_folder):
+        try:
+            # Including the leftovers of interrupted exports (*.tmp)
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(s for _, s, _ in entries)
+    removed = 0
+    for _, entry_size, entry_path in sorted(entries):
+        if size <= max_size * 1024 * 1024:
+            break
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+        removed += 1
+    return removed
+
+
+def render_and_measure(
+    content: str, base: str, working_folder: str, cached_pdf: Optional[str] = None
+) -> dict[int, int]:
+    """Render a markdown document with anchors and return its question page spans."""
+    return find_questions_in_pdf(render_pdf(content, base, working_folder, cached_pdf))
+
+
+def run_pool(func, jobs: Iterable[tuple[str, tuple]], max_workers: int, on_result=None):
+    """Run `func(*args)` for every job in a bounded process pool.
+
+    The jobs are consumed lazily: at most `2 * max_workers` of them are
+    submitted at any time, so a generator of jobs is never fully materialized.
+
+    Args:
+        func: Picklable function executed in the worker processes
+        jobs: Iterable of (job name (student base name), arguments) tuples
+        max_workers: Maximum number of concurrent worker processes
+        on_result: Optional callback `on_result(name, result)` called in the
+            main process as soon as a job succeeds. Its return value is stored
+            in place of the result. When it raises, the job fails.
+
+    Returns:
+        Tuple (results, failures), both dicts keyed by job name. A failing job
+        (in its worker or in `on_result`) does not abort the others, its error
+        message is stored in `failures`.
+
+    """
+    results = {}
+    failures = {}
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            name = pending.pop(future)
+            try:
+                result = future.result()
+                results[name] = on_result(name, result) if on_result else result
+            except Exception as e:
+                failures[name] = str(e)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for name, args in jobs:
+            if len(pending) >= 2 * max_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(func, *args)] = name
+        collect(as_completed(list(pending)))
+
+    return results, failures
+
+
+def generate_exam(
+    data: Iterable[FilledExam],
+    output_folder,
+    jobs: Optional[int] = None,
+    layout_only: bool = False,
+    use_cache: bool = True,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+):
+    """Export one PDF per exam, with the same number of pages per question.
+
+    The exams are first rendered with anchors (PDF named destinations) to
+    measure the page span of every question. Exams whose spans already match the maximum of
+    the cohort are kept as is, the others are rendered a second time with
+    the missing pages added.
+
+    `data` is iterated once per pass and the exams are rendered one by one, so
+    an `ExamCohort` keeps the memory usage independent of the cohort size.
+    Each final PDF is moved to `output_folder` as soon as it is ready.
+
+    Args:
+        data: Exams to export
+        output_folder: Folder in which the final PDFs are moved
+        jobs: Number of exams rendered concurrently (defaults to the core count)
+        layout_only: Only run the anchor pass and print the page spans and the
+            padding of every exam, without producing the final PDFs
+        use_cache: Serve the exams whose rendered markdown did not change
+            since the last export from the `.cache/` folder of `output_folder`
+        cache_size: Size of the `.cache/` folder in MB, the least recently
+            used PDFs are removed above it
+
+    Returns:
+        Dict mapping exam base name -> error message for failed exams
+
+    """
+    render = get_template().render
+
+    jobs = jobs or os.cpu_count() or 1
     working_folder = f"/tmp/{uuid.uuid1()}"
 
     mkdir(working_folder)
 
+    failures = {}
+    generated = {}
+
+    cache_folder = path.join(output_folder, ".cache")
+    toolchain = ""
+    if use_cache:
+        os.makedirs(cache_folder, exist_ok=True)
+        toolchain = toolchain_version()
+
     try:
 
-        def generate(add_anchors):
-            for d in data:
-                d.add_anchors = add_anchors
-                content = template.render(exam=d)
+        def render_all(exams, report=False):
+            reported_exams = set()
+            for d in exams:
+                # The anchors are kept in the final pass, so that the layout is
+                # exactly the one that was measured. They add no text to the PDF
+                d.add_anchors = True
                 base = d.firstname + "_" + d.lastname
-                markdown_filename = base + ".md"
-                markdown_filepath = path.join(working_folder, markdown_filename)
-
-                with open(
-                    markdown_filepath,
-                    "w",
-                ) as f:
-                    f.write(content)
-                subprocess.run(
-                    ["isc-build-pandoc", "-i", markdown_filename],
-                    cwd=working_folder,
-                    stdout=subprocess.DEVNULL,
-                )
-
-        pages = []
-        maxes = {}
+                if report:
+                    if id(d.exam) not in reported_exams:
+                        reported_exams.add(id(d.exam))
+                        for diagnostic in d.exam.diagnostics:
+                            print(f"Warning: {diagnostic}")
+                    for diagnostic in d.diagnostics:
+                        print(f"Warning: {base}: {diagnostic}")
+                content = render(exam=d)
+                cached_pdf = None
+                if use_cache:
+                    cached_pdf = path.join(cache_folder, cache_key(content, toolchain) + ".pdf")
+                yield base, (content, base, working_folder, cached_pdf)
+
+        def flush(base, pdf_path):
+            destination = path.join(output_folder, path.basename(pdf_path))
+            shutil.move(pdf_path, destination)
+            return destination
 
         # We generate the markdown -> pdfs with the anchors
-        generate(True)
+        start = time.perf_counter()
+        pages, anchor_failures = run_pool(
+            render_and_measure, render_all(data, report=True), jobs
+        )
+        failures.update(anchor_failures)
+        print(f"Anchor pass: {len(pages)} pdf files in {time.perf_counter() - start:.1f}s")
 
-        for d in data:
-            base = d.firstname + "_" + d.lastname
-            pdf_filepath = path.join(working_folder, base + ".pdf")
-            page_n = find_questions_in_pdf(pdf_filepath)
-            pages.append(page_n)
+        maxes = {}
+        for page_n in pages.values():
             for key, value in page_n.items():
                 if not key in maxes or maxes[key] < value:
                     maxes[key] = value
 
-        # This loop adds the right number of pagebreak to every exams.
-        for e, p in zip(data, pages, strict=True):
-            for i, q in enumerate(e.questions):
-                q.linebreak = maxes[i] - p[i]
-
-        # We then re-generate the markdown -> pdfs, but without the anchors this time
-        generate(False)
-
-        # Moving the generated files to the destination
-
-        for pdf_path in glob.glob(os.path.join(working_folder, "*.pdf")):
-            shutil.move(pdf_path, output_folder)
+        # Number of pagebreak to add to every question of every exam. A question
+        # whose markers are missing from a PDF cannot be measured: not padded
+        paddings = {
+            base: {i: maxes[i] - p[i] if i in p else 0 for i in sorted(maxes)}
+            for base, p in pages.items()
+        }
+        for base, p in sorted(pages.items()):
+            missing = [i for i in sorted(maxes) if i not in p]
+            if missing:
+                print(f"Warning: {base}: no markers for the questions {missing}, they are not padded")
+
+        if layout_only:
+            for base, p in pages.items():
+                print(f"{base}: spans={[p[i] for i in sorted(p)]} padding={list(paddings[base].values())}")
+            return failures
+
+        # Exams already matching the cohort layout: the anchor pass output is final
+        for base, padding in paddings.items():
+            if not any(padding.values()):
+                generated[base] = flush(base, path.join(working_folder, base + ".pdf"))
+        reused = len(generated)
+
+        def padded_exams():
+            # Students whose anchor pass failed are left out of the final pass
+            for e in data:
+                padding = paddings.get(e.firstname + "_" + e.lastname)
+                if padding and any(padding.values()):
+                    for i, q in enumerate(e.questions):
+                        q.linebreak = padding.get(i, 0)
+                    yield e
+
+        # We then re-generate the markdown -> pdfs of the exams needing padding
+        start = time.perf_counter()
+        regenerated, final_failures = run_pool(
+            render_pdf, render_all(padded_exams()), jobs, on_result=flush
+        )
+        failures.update(final_failures)
+        generated.update(regenerated)
+        print(
+            f"Final pass: {len(regenerated)} pdf files in {time.perf_counter() - start:.1f}s"
+            f" ({reused} reused from the anchor pass)"
+        )
+
+        if use_cache:
+            evict_cache(cache_folder, cache_size)
 
         # Removing the working folder
     finally:
         print("Cleaned working folder")
         subprocess.run(["rm", "-r", working_folder])
 
-    print(f"Generated {len(data)} pdf files")
+    print(f"Generated {len(generated)} pdf files")
 
+    for base, error in sorted(failures.items()):
+        print(f"Failed to generate {base}: {error}")
 
-def load_yaml(filepath: str):
-    yaml = YAML()
-    with open(filepath, "r") as f:
-        data = yaml.load(f)
+    return failures
 
-    filled_exams = FilledExam.from_yaml(data)
 
-    return filled_exams
+def load_yaml(filepath: str):
+    if exam_store.is_sharded(filepath):
+        return ExamCohort(exam_store.load_header(filepath), exam_path=filepath)
+
+    # Goes through the parse cache of the exam file
+    return ExamCohort(exam_store.load_exam(filepath))
 
 
 def main():
@@ -242,14 +604,59 @@ def main():
         description="Generate markdown files from exam YAML data"
     )
     parser.add_argument(
-        "-i", "--input", required=True, help="Path to input YAML file"
+        "-i", "--input", required=True, help="Path to input YAML file (or sharded exam folder)"
     )
     parser.add_argument(
         "-o", "--output", required=True, help="Path to output folder"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of students rendered concurrently (defaults to the number of cores)",
+    )
+    parser.add_argument(
+        "--layout-only",
+        action="store_true",
+        help="Only compute and print the page spans of every exam, without producing the final PDFs",
+    )
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        help="Export even if the exam does not follow the schema",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Render every exam again, ignoring the PDFs cached in the output folder",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help=f"Size of the PDFs cache of the output folder, in MB (default: {DEFAULT_CACHE_SIZE})",
+    )
     args = parser.parse_args()
 
-    generate_exam(load_yaml(args.input), args.output)
+    if not args.skip_validation:
+        issues = validate_exam(args.input)
+        for issue in issues:
+            print(issue)
+        if issues:
+            print(f"{len(issues)} error(s) found in the exam, nothing was exported")
+            sys.exit(1)
+
+    failures = generate_exam(
+        load_yaml(args.input),
+        args.output,
+        jobs=args.jobs,
+        layout_only=args.layout_only,
+        use_cache=not args.no_cache,
+        cache_size=args.cache_size,
+    )
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -4,12 +4,26 @@ Import student answers into an exam YAML file.
 
 Usage:
     python import_students_response.py <exam_filepath> --students '<json_list>'
+    python import_students_response.py <exam_filepath> --manifest <students.jsonl>
+    python import_students_response.py <exam_filepath> --from-dir <submissions_folder>
 
 Arguments:
-    exam_filepath    Path to the destination exam YAML file
+    exam_filepath    Path to the destination exam YAML file, or to a sharded exam
+                     folder (see `assets/exam_store.py`)
 
 Options:
     -s, --students   JSON string containing a list of student dictionaries
+    -m, --manifest   Path to a file listing the students: `.json` (same list as
+                     --students), `.jsonl` (one student dictionary per line) or
+                     `.csv` (columns `firstname,lastname,question_id,path`)
+    -d, --from-dir   Path to a submissions folder, the students are built from
+                     its structure (see --layout)
+    --layout         With --from-dir, `student` (default): one folder or file per
+                     student, named `Firstname_Lastname`; `exercise`: one folder
+                     per question containing one `Firstname_Lastname` file per student
+    --workers        Number of submission files read in parallel (default 16)
+    --max-size       Submission files larger than this (in bytes, default 1 MiB)
+                     are not imported
 
 Student list format:
     [
@@ -30,11 +44,27 @@ Examples:
     # Multiple students
     python import_students_response.py "./exams/exam.yaml" --students '[{"firstname": "John", "lastname": "Doe", "submissions": {"1": "john/q1.txt"}}, {"firstname": "Jane", "lastname": "Smith", "submissions": {"1": "jane/q1.txt"}}]'
 
+    # Students listed in a manifest file
+    python import_students_response.py "./exams/exam.yaml" --manifest "./submissions/students.csv"
+
+    # Students built from the folder structure (./submissions/John_Doe/ex1.py ...)
+    python import_students_response.py "./exams/exam.yaml" --from-dir "./submissions"
+
+    # Import a large cohort in batches into a sharded exam, then write the exam YAML once
+    python assets/exam_store.py split "./exams/exam.yaml" "./exams/exam"
+    python import_students_response.py "./exams/exam" --students '[...]'
+    python import_students_response.py "./exams/exam" --students '[...]'
+    python assets/exam_store.py join "./exams/exam" "./exams/exam.yaml"
+
 Notes:
     - If the exam file doesn't exist, it will be created
     - If a student (matched by firstname + lastname) already exists, their data will be updated
     - submissions is a dict mapping question_id (number as string) -> answer file path
     - The script reads the content from each answer file and stores it in the answers array
+    - The encoding of each answer file is detected (UTF-8/16 with BOM, UTF-8, cp1252, latin-1)
+    - Missing, binary or too large answer files are not imported: they are listed at the
+      end with the reason, and the script exits with a non-zero code. The other answers
+      are imported anyway.
 """
 
 import argparse
@@ -43,12 +73,31 @@ from ruamel.yaml import YAML
 from pathlib import Path
 
 import argparse
+import codecs
+import csv
 import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import batched
 from pathlib import Path
+from typing import Iterable, Iterator
 
 from ruamel.yaml import YAML
 from ruamel.yaml.scalarstring import LiteralScalarString
 
+# Shared exam modules live in the assets of the skill
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "assets"))
+import exam_store  # noqa: E402
+
+
+# Submission files are often on network mounts, where reading is latency bound
+READ_WORKERS = 16
+MAX_SUBMISSION_SIZE = 1024 * 1024
+# Number of students whose submissions are read at the same time
+IMPORT_BATCH_SIZE = 64
+# A NUL byte in the first bytes of a file means it is not a text file
+BINARY_SNIFF_SIZE = 8192
 
 yaml = YAML()
 yaml.preserve_quotes = True
@@ -56,14 +105,145 @@ yaml.sort_base_mapping_type_on_output = False
 yaml.default_flow_style = False
 
 
-def import_students(exam_filepath: str, students: list):
-    exam_path = Path(exam_filepath)
+def decode_submission(raw: bytes) -> str:
+    """Decode the content of a submission file, detecting its encoding.
+
+    Raises:
+        ValueError: If the file looks like a binary file
+    """
+    if raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return raw.decode("utf-16")
+    if raw.startswith(codecs.BOM_UTF8):
+        return raw.decode("utf-8-sig")
+    if b"\0" in raw[:BINARY_SNIFF_SIZE]:
+        raise ValueError("Binary file")
+
+    # Submissions exported from Windows machines are often in cp1252,
+    # latin-1 never fails and is the last resort
+    for encoding in ("utf-8", "cp1252"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return raw.decode("latin-1")
+
+
+def read_submission(filepath: str, max_size: int = MAX_SUBMISSION_SIZE) -> str:
+    file_path = Path(filepath)
+
+    if not file_path.is_file():
+        raise FileNotFoundError("File not found")
+
+    size = file_path.stat().st_size
+    if size > max_size:
+        raise ValueError(f"File too large ({size} bytes, max {max_size})")
+
+    return decode_submission(file_path.read_bytes())
+
+
+def read_submissions(
+    students: list, max_workers: int = READ_WORKERS, max_size: int = MAX_SUBMISSION_SIZE
+):
+    """Read all the submission files of the students concurrently.
+
+    Args:
+        students: List of student dictionaries (see the module docstring)
+        max_workers: Number of files read in parallel
+        max_size: Files larger than this (in bytes) are not imported
+
+    Returns:
+        Tuple (contents, errors), dicts mapping file path -> content and
+        file path -> error message for the files that could not be read
+    """
+    filepaths = {
+        str(filepath)
+        for student in students
+        for filepath in student.get("submissions", {}).values()
+    }
 
-    if not exam_path.exists():
-        raise FileNotFoundError(f"Exam file not found: {exam_filepath}")
+    contents = {}
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(read_submission, filepath, max_size): filepath
+            for filepath in filepaths
+        }
+        for future in as_completed(futures):
+            filepath = futures[future]
+            try:
+                contents[filepath] = future.result()
+            except (OSError, ValueError) as e:
+                errors[filepath] = str(e)
+
+    return contents, errors
+
+
+def build_student_entry(student: dict, contents: dict) -> dict:
+    submissions = student.get("submissions", {})
+
+    answers = []
+    for question_id_str, filepath in submissions.items():
+        question_id = int(question_id_str)
+
+        # Files that could not be read are reported, not imported: the answer
+        # imported before, if any, is kept (see `merge_answers`)
+        if str(filepath) not in contents:
+            continue
+
+        answers.append(
+            {
+                "question_id": question_id,
+                "content": LiteralScalarString(contents[str(filepath)]),
+                "points": None,
+                "correction_details": None,
+            }
+        )
 
-    with open(exam_path, "r", encoding="utf-8") as f:
-        exam_data = yaml.load(f) or {}
+    return {
+        "firstname": student.get("firstname", ""),
+        "lastname": student.get("lastname", ""),
+        "answers": answers,
+    }
+
+
+def merge_answers(student: dict, answers: list):
+    """Add `answers` to the answers of `student`, replacing the ones to the same questions.
+
+    The answers to the other questions are kept with their points, e.g. the
+    ones whose file could not be read this time. An answer whose content did
+    not change is kept as is.
+    """
+    if student.get("answers") is None:
+        student["answers"] = []
+    index = {answer.get("question_id"): i for i, answer in enumerate(student["answers"])}
+    for answer in answers:
+        i = index.get(answer["question_id"])
+        if i is None:
+            index[answer["question_id"]] = len(student["answers"])
+            student["answers"].append(answer)
+        elif student["answers"][i].get("content") != answer["content"]:
+            student["answers"][i] = answer
+
+
+def upsert_students(exam_path: Path, student_entries):
+    """Load the exam YAML once, add the given students or merge their answers, and dump it.
+
+    A sharded exam is not loaded: only the files of the given students are written.
+    """
+    if exam_store.is_sharded(exam_path):
+        folder = exam_path / exam_store.STUDENTS_FOLDER
+        for student_entry in student_entries:
+            filepath = exam_store.student_filepath(folder, student_entry)
+            if filepath.exists():
+                existing = exam_store.load_yaml_file(filepath) or {}
+                merge_answers(existing, student_entry["answers"])
+                exam_store.remember_file(existing, filepath)
+                student_entry = existing
+            exam_store.save_student(exam_path, student_entry)
+        return
+
+    exam_data = exam_store.load_yaml_file(exam_path, cached=True) or {}
 
     if "student_response" not in exam_data or exam_data["student_response"] is None:
         exam_data["student_response"] = []
@@ -73,37 +253,13 @@ def import_students(exam_filepath: str, students: list):
         for i, s in enumerate(exam_data["student_response"])
     }
 
-    for student in students:
-        key = student.get("firstname", "") + student.get("lastname", "")
-        submissions = student.get("submissions", {})
-
-        answers = []
-        for question_id_str, filepath in submissions.items():
-            question_id = int(question_id_str)
-            file_path = Path(filepath)
-
-            assert file_path.exists()
-
-            content = file_path.read_text(encoding="utf-8")
-
-            answers.append(
-                {
-                    "question_id": question_id,
-                    "content": LiteralScalarString(content),
-                    "points": None,
-                    "correction_details": None,
-                }
-            )
-
-        student_entry = {
-            "firstname": student.get("firstname", ""),
-            "lastname": student.get("lastname", ""),
-            "answers": answers,
-        }
+    for student_entry in student_entries:
+        key = student_entry.get("firstname", "") + student_entry.get("lastname", "")
 
         if key in existing_students:
-            exam_data["student_response"][existing_students[key]] = student_entry
+            merge_answers(exam_data["student_response"][existing_students[key]], student_entry["answers"])
         else:
+            existing_students[key] = len(exam_data["student_response"])
             exam_data["student_response"].append(student_entry)
 
     exam_path.parent.mkdir(parents=True, exist_ok=True)
@@ -112,20 +268,258 @@ def import_students(exam_filepath: str, students: list):
         yaml.dump(exam_data, f)
 
 
+def load_manifest(manifest_filepath: str) -> Iterator[dict]:
+    """Stream the students of a manifest file.
+
+    Supported formats (by extension):
+        - `.json`: a list of student dictionaries, as for `--students`
+        - `.jsonl`: one student dictionary per line
+        - `.csv`: one submission per row, with the columns
+          `firstname,lastname,question_id,path`
+
+    Relative submission paths are resolved against the manifest folder.
+    """
+    manifest_path = Path(manifest_filepath)
+    suffix = manifest_path.suffix.lower()
+
+    def resolve(student):
+        student["submissions"] = {
+            question_id: str(manifest_path.parent / filepath)
+            for question_id, filepath in student.get("submissions", {}).items()
+        }
+        return student
+
+    with open(manifest_path, "r", encoding="utf-8", newline="") as f:
+        if suffix == ".json":
+            for student in json.load(f):
+                yield resolve(student)
+        elif suffix == ".jsonl":
+            for line in f:
+                if line.strip():
+                    yield resolve(json.loads(line))
+        elif suffix == ".csv":
+            # Only the file paths are kept while grouping the rows by student
+            students = {}
+            for row in csv.DictReader(f):
+                key = (row["firstname"].strip(), row["lastname"].strip())
+                student = students.setdefault(
+                    key, {"firstname": key[0], "lastname": key[1], "submissions": {}}
+                )
+                student["submissions"][row["question_id"].strip()] = row["path"].strip()
+            for student in students.values():
+                yield resolve(student)
+        else:
+            raise ValueError(f"Unsupported manifest format: {manifest_path.suffix}")
+
+
+def split_name(name: str) -> tuple[str, str]:
+    """Split a file or folder name into (firstname, lastname).
+
+    "John_Doe", "John Doe" and "JohnDoe" all give ("John", "Doe"). The first
+    `_` separates the names, so compound names are kept: "Jean-Pierre_Dupont"
+    gives ("Jean-Pierre", "Dupont") and "Marie Claire_Martin" gives
+    ("Marie Claire", "Martin"). Without `_`, the first whitespace does. A `-`
+    never separates the names.
+    """
+    name = name.strip()
+    parts = name.split("_", 1) if "_" in name else name.split(None, 1)
+    if len(parts) == 1:
+        parts = re.split(r"(?<=[a-z])(?=[A-Z])", name, maxsplit=1)
+    if len(parts) == 1:
+        return name, ""
+    return parts[0], parts[1].replace("_", " ")
+
+
+def natural_key(file_path: Path):
+    """Sort key ordering `ex2.py` before `ex10.py`."""
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", file_path.name)]
+
+
+def walk_submissions(
+    folder: str, question_ids: list, errors: dict, layout: str = "student"
+) -> Iterator[dict]:
+    """Build the students list from the structure of a submissions folder.
+
+    Layouts:
+        - `student`: one subfolder per student (`<folder>/John_Doe/ex1.py`), or
+          one file per student (`<folder>/John_Doe.py`)
+        - `exercise`: one subfolder per question, with one file per student
+          (`<folder>/ex1/John_Doe.py`)
+
+    Files and exercise folders are sorted in natural order and matched to the
+    questions in order. A student with fewer or more files than the exam has
+    questions is reported in `errors`, not guessed.
+
+    Args:
+        folder: Path to the submissions folder
+        question_ids: Ids of the exam questions, in order
+        errors: Dict filled with path -> error message for the entries that
+            could not be matched to the questions
+        layout: Layout of the submissions folder (see above)
+    """
+    if not question_ids:
+        raise ValueError("The exam has no questions")
+
+    root = Path(folder)
+    entries = sorted(
+        (p for p in root.iterdir() if not p.name.startswith(".")), key=natural_key
+    )
+
+    def match(path, files):
+        if len(files) == len(question_ids):
+            return {str(q): str(f) for q, f in zip(question_ids, files)}
+        errors[str(path)] = (
+            f"Cannot match {len(files)} files to {len(question_ids)} questions"
+        )
+        return None
+
+    if layout == "student":
+        for entry in entries:
+            if entry.is_dir():
+                files = sorted(
+                    (p for p in entry.rglob("*") if p.is_file() and not p.name.startswith(".")),
+                    key=natural_key,
+                )
+            else:
+                files = [entry]
+            submissions = match(entry, files)
+            if submissions:
+                firstname, lastname = split_name(entry.stem if entry.is_file() else entry.name)
+                yield {"firstname": firstname, "lastname": lastname, "submissions": submissions}
+
+    elif layout == "exercise":
+        exercises = [p for p in entries if p.is_dir()]
+        if len(exercises) != len(question_ids):
+            errors[str(root)] = (
+                f"Cannot match {len(exercises)} folders to {len(question_ids)} questions"
+            )
+            return
+        # Only the file paths are kept while grouping the files by student
+        students = {}
+        for question_id, exercise in zip(question_ids, exercises):
+            for file_path in sorted(exercise.iterdir(), key=natural_key):
+                if not file_path.is_file() or file_path.name.startswith("."):
+                    continue
+                firstname, lastname = split_name(file_path.stem)
+                student = students.setdefault(
+                    (firstname, lastname),
+                    {"firstname": firstname, "lastname": lastname, "submissions": {}},
+                )
+                student["submissions"][str(question_id)] = str(file_path)
+        yield from students.values()
+
+    else:
+        raise ValueError(f"Unknown layout: {layout}")
+
+
+def exam_question_ids(exam_path: Path) -> list:
+    exam_data = exam_store.load_header(exam_path)
+    return [q["id"] for q in exam_data.get("questions") or []]
+
+
+def import_students(
+    exam_filepath: str,
+    students: Iterable[dict],
+    max_workers: int = READ_WORKERS,
+    max_size: int = MAX_SUBMISSION_SIZE,
+):
+    """Import the students answers into the exam.
+
+    The students are consumed in batches of `IMPORT_BATCH_SIZE`, so a manifest
+    or a folder walk is streamed instead of being read all at once.
+
+    Args:
+        exam_filepath: Path to the exam YAML file, or to a sharded exam folder
+            (see `exam_store.py`), in which case only the imported students
+            files are written
+        students: Iterable of student dictionaries (see the module docstring)
+        max_workers: Number of submission files read in parallel
+        max_size: Submission files larger than this (in bytes) are not imported
+
+    Returns:
+        Dict mapping file path -> error message for the submission files that
+        could not be imported. The other answers are imported anyway.
+    """
+    exam_path = Path(exam_filepath)
+
+    if not exam_path.exists():
+        raise FileNotFoundError(f"Exam file not found: {exam_filepath}")
+
+    errors = {}
+
+    def iter_student_entries():
+        for batch in batched(students, IMPORT_BATCH_SIZE):
+            contents, batch_errors = read_submissions(batch, max_workers, max_size)
+            errors.update(batch_errors)
+            for student in batch:
+                yield build_student_entry(student, contents)
+
+    upsert_students(exam_path, iter_student_entries())
+    return errors
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Import student answers into exam YAML file"
     )
-    parser.add_argument("exam_filepath", help="Destination exam YAML file path")
+    parser.add_argument("exam_filepath", help="Destination exam YAML file path, or sharded exam folder")
+    students_source = parser.add_mutually_exclusive_group(required=True)
+    students_source.add_argument(
+        "--students", "-s", help="JSON string of students list"
+    )
+    students_source.add_argument(
+        "--manifest",
+        "-m",
+        help="Path to a JSON, JSONL or CSV file listing the students",
+    )
+    students_source.add_argument(
+        "--from-dir",
+        "-d",
+        help="Path to a submissions folder, the students list is built from its structure",
+    )
     parser.add_argument(
-        "--students", "-s", required=True, help="JSON string of students list"
+        "--layout",
+        choices=["student", "exercise"],
+        default="student",
+        help="With --from-dir: one folder (or file) per student, or one folder per question",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=READ_WORKERS,
+        help="Number of submission files read in parallel",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        default=MAX_SUBMISSION_SIZE,
+        help="Submission files larger than this (in bytes) are not imported",
     )
 
     args = parser.parse_args()
 
-    students = json.loads(args.students)
+    errors = {}
+    if args.students is not None:
+        students = json.loads(args.students)
+    elif args.manifest is not None:
+        students = load_manifest(args.manifest)
+    else:
+        question_ids = exam_question_ids(Path(args.exam_filepath))
+        students = walk_submissions(args.from_dir, question_ids, errors, args.layout)
+
+    errors.update(
+        import_students(
+            args.exam_filepath,
+            students,
+            max_workers=args.workers,
+            max_size=args.max_size,
+        )
+    )
+    for filepath, error in sorted(errors.items()):
+        print(f"Could not import {filepath}: {error}")
 
-    import_students(args.exam_filepath, students)
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
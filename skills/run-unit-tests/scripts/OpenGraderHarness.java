@@ -0,0 +1,119 @@
+/*
+ * Run the unit tests of a Java question against one student answer.
+ *
+ * Counterpart of `harness.py` for the JVM: the tests are the methods named
+ * `test*` without parameters of the class `Tests`, compiled with the answer,
+ * run in alphabetical order (static methods, or instance methods on a new
+ * instance for every test). They check their results with `assert` (run with
+ * `java -ea`), or by throwing an AssertionError.
+ *
+ * The results file gets the same records as with `harness.py`, including the
+ * `<load>` error.
+ *
+ * Usage:
+ *     java -ea OpenGraderHarness <tests class> <results.jsonl>
+ */
+import java.io.FileOutputStream;
+import java.io.OutputStreamWriter;
+import java.io.PrintWriter;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.lang.reflect.Modifier;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.Comparator;
+import java.util.List;
+
+public class OpenGraderHarness {
+    private static final int MAX_MESSAGE_LENGTH = 500;
+
+    private static String jsonString(String value) {
+        if (value == null) {
+            return "null";
+        }
+        if (value.length() > MAX_MESSAGE_LENGTH) {
+            value = value.substring(0, MAX_MESSAGE_LENGTH);
+        }
+        StringBuilder res = new StringBuilder("\"");
+        for (char c : value.toCharArray()) {
+            switch (c) {
+                case '"': res.append("\\\""); break;
+                case '\\': res.append("\\\\"); break;
+                case '\n': res.append("\\n"); break;
+                case '\t': res.append("\\t"); break;
+                default:
+                    if (c < 0x20) {
+                        res.append(String.format("\\u%04x", (int) c));
+                    } else {
+                        res.append(c);
+                    }
+            }
+        }
+        return res.append('"').toString();
+    }
+
+    private static String errorMessage(Throwable error) {
+        String message = error.getMessage();
+        String name = error.getClass().getSimpleName();
+        return message == null ? name : name + ": " + message;
+    }
+
+    private static void record(PrintWriter results, String name, String outcome, double duration, String message) {
+        results.printf("{\"name\": %s, \"outcome\": \"%s\", \"duration\": %.6f, \"message\": %s}%n",
+                jsonString(name), outcome, duration, jsonString(message));
+        results.flush();
+    }
+
+    public static void main(String[] args) throws Exception {
+        if (args.length != 2) {
+            System.err.println("Usage: java -ea OpenGraderHarness <tests class> <results.jsonl>");
+            System.exit(2);
+        }
+        PrintWriter results = new PrintWriter(new OutputStreamWriter(
+                new FileOutputStream(args[1], true), StandardCharsets.UTF_8));
+
+        long start = System.nanoTime();
+        List<Method> tests = new ArrayList<>();
+        Class<?> testsClass;
+        try {
+            testsClass = Class.forName(args[0]);
+            for (Method method : testsClass.getDeclaredMethods()) {
+                if (method.getName().startsWith("test") && method.getParameterCount() == 0) {
+                    method.setAccessible(true);
+                    tests.add(method);
+                }
+            }
+        } catch (Throwable e) {
+            record(results, "<load>", "error", (System.nanoTime() - start) / 1e9, errorMessage(e));
+            return;
+        }
+        tests.sort(Comparator.comparing(Method::getName));
+        for (Method test : tests) {
+            record(results, test.getName(), "collected", 0, null);
+        }
+
+        for (Method test : tests) {
+            start = System.nanoTime();
+            String outcome = "passed";
+            String message = null;
+            try {
+                Object instance = null;
+                if (!Modifier.isStatic(test.getModifiers())) {
+                    var constructor = testsClass.getDeclaredConstructor();
+                    constructor.setAccessible(true);
+                    instance = constructor.newInstance();
+                }
+                test.invoke(instance);
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                outcome = cause instanceof AssertionError ? "failed" : "error";
+                message = errorMessage(cause);
+            } catch (Throwable e) {
+                outcome = "error";
+                message = errorMessage(e);
+            }
+            record(results, test.getName(), outcome, (System.nanoTime() - start) / 1e9, message);
+        }
+        System.exit(0);
+    }
+}
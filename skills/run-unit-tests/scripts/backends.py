@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Test execution backends, one per question `type` (see `assets/schema.yaml`).
+
+A backend runs the unit tests of a question against one answer in three steps:
+
+- `prepare`: once per question, in a folder shared by all its answers. Compiles
+  the harness of the language and, when possible, the tests themselves.
+- `build`: once per answer, in its own folder. Writes the answer and compiles
+  it. Raises `BuildError` with the compiler message when it does not compile.
+- `run`: runs the tests in the sandbox (see `sandbox.py`). Every harness appends
+  the same records to `results.jsonl` (see `harness.py`), so the results of all
+  the languages are read the same way by the runner.
+
+Backends:
+    python      `harness.py`, in a warm worker (see `worker.py`) or a new interpreter
+    javascript  `harness.js`, with `node`
+    java        `OpenGraderHarness.java`, with `javac` and `java`
+    cpp         `harness_main.cpp` and `opengrader_test.hpp`, with `g++`
+
+The toolchains are run from the PATH: a backend whose executables are missing
+is not `available`, and its questions are skipped by the runner.
+
+The compilations go through a `CompileCache` when one is given (see
+`compile_cache.py`): an answer (or tests) that did not change since the last
+run is not compiled again, only linked with the tests.
+"""
+
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+from abc import ABC, abstractmethod
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, List
+
+from compile_cache import CompileCache
+from worker import WorkerPool
+
+SCRIPTS_FOLDER = Path(__file__).resolve().parent
+
+# Compilers are trusted, but not the code they compile (e.g. huge templates)
+COMPILE_TIME_LIMIT = 60
+# Enough for the compilers and the JVM, which keep many files open
+TOOLCHAIN_OPEN_FILES = 1024
+MAX_MESSAGE_LENGTH = 500
+ERROR_LINE = re.compile(r"error|undefined reference", re.I)
+# Paths of the temporary folders, meaningless in the messages
+TEMPORARY_PATH = re.compile(r"\S*/opengrader-[\w-]+/(?:question-\d+/)?")
+
+
+class BuildError(Exception):
+    """The answer (or the tests of a question) does not compile."""
+
+
+class CompileTimeout(BuildError):
+    """The compilation was stopped: not cached, it may pass on a less loaded machine."""
+
+
+def sandbox_command(
+    command: List[str], time_limit: int, memory_limit: int = None, open_files: int = None
+) -> List[str]:
+    res = [sys.executable, str(SCRIPTS_FOLDER / "sandbox.py"), "--cpu", str(time_limit)]
+    if memory_limit:
+        res += ["--memory", str(memory_limit)]
+    if open_files:
+        res += ["--open-files", str(open_files)]
+    return [*res, "--", *command]
+
+
+def run_sandboxed(
+    command: List[str], folder: Path, time_limit: int, memory_limit: int = None, open_files: int = None
+) -> tuple:
+    """Run `command` in `folder`, in the sandbox.
+
+    Args:
+        memory_limit: Address space limit in MB. None for the runtimes reserving
+            far more address space than they use (node, the JVM), which get a
+            heap limit of their own instead
+
+    Returns:
+        Tuple (returncode, timed_out, stderr)
+    """
+    process = subprocess.Popen(
+        sandbox_command(command, time_limit, memory_limit, open_files),
+        cwd=folder,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env={"PATH": os.environ.get("PATH", ""), "LANG": "C.UTF-8", "HOME": str(folder)},
+        # Own process group, to kill the children of the answer too
+        start_new_session=True,
+    )
+    timed_out = False
+    try:
+        _, stderr = process.communicate(timeout=2 * time_limit + 5)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        os.killpg(process.pid, signal.SIGKILL)
+        _, stderr = process.communicate()
+    return process.returncode, timed_out, stderr.decode("utf-8", errors="replace")
+
+
+def compiler_message(stderr: str) -> str:
+    """First error of a compiler output (the following ones are often consequences)."""
+    lines = [TEMPORARY_PATH.sub("", line) for line in stderr.strip().splitlines() if line.strip()]
+    for i, line in enumerate(lines):
+        if ERROR_LINE.search(line):
+            return "\n".join(lines[i:i + 3])[:MAX_MESSAGE_LENGTH]
+    return "\n".join(lines[-3:])[:MAX_MESSAGE_LENGTH]
+
+
+def compile_in(command: List[str], folder: Path, what: str = "The answer"):
+    """Run a compilation `command` in `folder`, raising BuildError if it fails."""
+    returncode, timed_out, stderr = run_sandboxed(
+        command, folder, COMPILE_TIME_LIMIT, open_files=TOOLCHAIN_OPEN_FILES
+    )
+    if timed_out or returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        raise CompileTimeout(f"{what} did not compile in {COMPILE_TIME_LIMIT}s")
+    if returncode != 0:
+        raise BuildError(f"{what} does not compile: {compiler_message(stderr)}")
+
+
+class Backend(ABC):
+    """Base class of the backends (see the module docstring)."""
+
+    language = None
+    executables = ()
+    # Prints the version of the compiler, part of the keys of the compilation cache
+    version_command = None
+
+    def available(self) -> bool:
+        return all(shutil.which(executable) for executable in self.executables)
+
+    @cached_property
+    def toolchain(self) -> str:
+        """Identify the toolchain: changes whenever the compiler is updated."""
+        parts = [f"{shutil.which(e)}:{os.stat(shutil.which(e)).st_mtime_ns}" for e in self.executables]
+        if self.version_command:
+            try:
+                result = subprocess.run(self.version_command, capture_output=True, text=True, check=True)
+                # javac prints its version on stderr before Java 9
+                parts.append((result.stdout or result.stderr).strip().splitlines()[0])
+            except (OSError, IndexError, subprocess.CalledProcessError):
+                pass
+        return "\n".join(parts)
+
+    def compile(
+        self,
+        command: List[str],
+        folder: Path,
+        sources: Dict[str, str],
+        outputs: List[str],
+        cache: CompileCache = None,
+        what: str = "The answer",
+    ):
+        """Run a compilation `command` in `folder`, unless its `outputs` are in `cache`.
+
+        Args:
+            sources: Content of the compiled files (filename -> content), already
+                written in `folder`. They are part of the key of the cache entry,
+                with the toolchain and the command
+            outputs: Files or folders created by the command, relative to `folder`
+            what: Subject of the error messages
+
+        Raises:
+            BuildError: The compilation failed, now or when it was cached
+        """
+        if cache is None:
+            compile_in(command, folder, what)
+            return
+
+        key = cache.key(self.toolchain, command, sources)
+        error = cache.fetch(key, folder)
+        if error:
+            raise BuildError(error)
+        if error is not None:
+            return
+        try:
+            compile_in(command, folder, what)
+        except CompileTimeout:
+            raise
+        except BuildError as e:
+            cache.store_error(key, str(e))
+            raise
+        cache.store(key, folder, outputs)
+
+    @abstractmethod
+    def prepare(self, tests: str, prepared: Path, cache: CompileCache = None):
+        """Prepare the `tests` of a question in the folder `prepared`."""
+
+    @abstractmethod
+    def build(self, answer: str, folder: Path, prepared: Path, cache: CompileCache = None):
+        """Write (and compile) `answer` in `folder`. Raises BuildError."""
+
+    @abstractmethod
+    def run(self, folder: Path, prepared: Path, time_limit: int, memory_limit: int, pool: WorkerPool = None) -> tuple:
+        """Run the tests of the answer built in `folder`.
+
+        Returns:
+            Tuple (returncode, timed_out, stderr)
+        """
+
+
+class PythonBackend(Backend):
+    """Nothing to compile: the answers run in warm workers when a pool is given."""
+
+    language = "python"
+    executables = ()
+
+    def prepare(self, tests: str, prepared: Path, cache: CompileCache = None):
+        (prepared / "tests.py").write_text(tests, encoding="utf-8")
+
+    def build(self, answer: str, folder: Path, prepared: Path, cache: CompileCache = None):
+        (folder / "solution.py").write_text(answer, encoding="utf-8")
+        shutil.copyfile(prepared / "tests.py", folder / "tests.py")
+
+    def run(self, folder: Path, prepared: Path, time_limit: int, memory_limit: int, pool: WorkerPool = None) -> tuple:
+        if pool is None:
+            return run_sandboxed(
+                # -I: ignore the environment and the user site-packages
+                [sys.executable, "-I", str(SCRIPTS_FOLDER / "harness.py"),
+                 "solution.py", "tests.py", "results.jsonl"],
+                folder,
+                time_limit,
+                memory_limit,
+            )
+        response = pool.run(str(folder), time_limit, memory_limit)
+        stderr_filepath = folder / "stderr.txt"
+        stderr = stderr_filepath.read_text(errors="replace") if stderr_filepath.exists() else ""
+        return response["returncode"], response["timed_out"], stderr
+
+
+class JavaScriptBackend(Backend):
+    """Nothing to compile either: node parses the answer when running the tests."""
+
+    language = "javascript"
+    executables = ("node",)
+
+    def prepare(self, tests: str, prepared: Path, cache: CompileCache = None):
+        shutil.copyfile(SCRIPTS_FOLDER / "harness.js", prepared / "harness.js")
+        (prepared / "tests.js").write_text(tests, encoding="utf-8")
+
+    def build(self, answer: str, folder: Path, prepared: Path, cache: CompileCache = None):
+        (folder / "solution.js").write_text(answer, encoding="utf-8")
+
+    def run(self, folder: Path, prepared: Path, time_limit: int, memory_limit: int, pool: WorkerPool = None) -> tuple:
+        return run_sandboxed(
+            ["node", f"--max-old-space-size={memory_limit}", str(prepared / "harness.js"),
+             "solution.js", str(prepared / "tests.js"), "results.jsonl"],
+            folder,
+            time_limit,
+            open_files=TOOLCHAIN_OPEN_FILES,
+        )
+
+
+class JavaBackend(Backend):
+    """
+    The harness is compiled once per question. The tests (class `Tests`) refer
+    to the classes of the answer, so they are compiled against each answer,
+    after it: changing the tests does not compile the answers again.
+    """
+
+    language = "java"
+    executables = ("javac", "java")
+    version_command = ["javac", "-version"]
+    JAVAC = ["javac", "-encoding", "UTF-8", "-nowarn"]
+
+    PUBLIC_CLASS = re.compile(r"^\s*public\s+(?:(?:final|abstract)\s+)*(?:class|interface|enum|record)\s+(\w+)", re.M)
+
+    def prepare(self, tests: str, prepared: Path, cache: CompileCache = None):
+        harness = (SCRIPTS_FOLDER / "OpenGraderHarness.java").read_text(encoding="utf-8")
+        (prepared / "OpenGraderHarness.java").write_text(harness, encoding="utf-8")
+        (prepared / "Tests.java").write_text(tests, encoding="utf-8")
+        self.compile(
+            [*self.JAVAC, "-d", "harness", "OpenGraderHarness.java"], prepared,
+            {"OpenGraderHarness.java": harness}, ["harness"], cache, "The test harness",
+        )
+
+    def build(self, answer: str, folder: Path, prepared: Path, cache: CompileCache = None):
+        # A public class must be in the file of the same name
+        match = self.PUBLIC_CLASS.search(answer)
+        filename = f"{match.group(1)}.java" if match else "Solution.java"
+        if filename == "Tests.java":
+            raise BuildError("The answer does not compile: its class Tests conflicts with the tests")
+        (folder / filename).write_text(answer, encoding="utf-8")
+        self.compile([*self.JAVAC, "-d", "classes", filename], folder, {filename: answer}, ["classes"], cache)
+
+        tests = (prepared / "Tests.java").read_text(encoding="utf-8")
+        (folder / "Tests.java").write_text(tests, encoding="utf-8")
+        self.compile(
+            [*self.JAVAC, "-cp", "classes", "-d", "tests", "Tests.java"], folder,
+            {filename: answer, "Tests.java": tests}, ["tests"], cache, "Tests.java",
+        )
+
+    def run(self, folder: Path, prepared: Path, time_limit: int, memory_limit: int, pool: WorkerPool = None) -> tuple:
+        return run_sandboxed(
+            ["java", "-ea", f"-Xmx{memory_limit}m", "-XX:+UseSerialGC",
+             "-cp", os.pathsep.join(["classes", "tests", str(prepared / "harness")]),
+             "OpenGraderHarness", "Tests", "results.jsonl"],
+            folder,
+            time_limit,
+            open_files=TOOLCHAIN_OPEN_FILES,
+        )
+
+
+class CppBackend(Backend):
+    """
+    The harness and the tests are compiled once per question, the answer on its
+    own, then linked with them. The tests declare the prototypes of the
+    functions of the answer they call.
+    """
+
+    language = "cpp"
+    executables = ("g++",)
+    version_command = ["g++", "--version"]
+
+    FLAGS = ["-std=c++17", "-O2"]
+
+    def prepare(self, tests: str, prepared: Path, cache: CompileCache = None):
+        sources = {
+            filename: (SCRIPTS_FOLDER / filename).read_text(encoding="utf-8")
+            for filename in ("opengrader_test.hpp", "harness_main.cpp")
+        }
+        sources["tests.cpp"] = tests
+        for filename, content in sources.items():
+            (prepared / filename).write_text(content, encoding="utf-8")
+        for source in ("harness_main.cpp", "tests.cpp"):
+            self.compile(
+                ["g++", *self.FLAGS, "-include", "opengrader_test.hpp", "-c", source], prepared,
+                {"opengrader_test.hpp": sources["opengrader_test.hpp"], source: sources[source]},
+                [source.replace(".cpp", ".o")], cache, source,
+            )
+
+    def build(self, answer: str, folder: Path, prepared: Path, cache: CompileCache = None):
+        (folder / "solution.cpp").write_text(answer, encoding="utf-8")
+        # The `main` of the answer (if any) must not clash with the one of the harness
+        self.compile(
+            ["g++", *self.FLAGS, "-Dmain=opengrader_student_main", "-c", "solution.cpp"], folder,
+            {"solution.cpp": answer}, ["solution.o"], cache,
+        )
+        # Only linked for every run: the tests may have changed
+        compile_in(
+            ["g++", "-o", "tests", str(prepared / "harness_main.o"), str(prepared / "tests.o"), "solution.o"],
+            folder,
+        )
+
+    def run(self, folder: Path, prepared: Path, time_limit: int, memory_limit: int, pool: WorkerPool = None) -> tuple:
+        return run_sandboxed(["./tests", "results.jsonl"], folder, time_limit, memory_limit)
+
+
+BACKENDS: Dict[str, Backend] = {
+    backend.language: backend
+    for backend in (PythonBackend(), JavaScriptBackend(), JavaBackend(), CppBackend())
+}
+
+
+def available_backends() -> Dict[str, Backend]:
+    return {language: backend for language, backend in BACKENDS.items() if backend.available()}
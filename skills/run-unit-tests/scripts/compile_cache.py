@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Cache of the compiled answers, shared by the runs of the tests.
+
+Running the tests again (e.g. after fixing one of them) must not compile every
+answer again: the outputs of a compilation are stored under the hash of
+everything they depend on (toolchain version, command line with its flags,
+content of the sources). A compilation error is cached too, so an answer that
+does not compile is not compiled again either.
+
+Layout: one folder per entry, named after its key, in
+`~/.cache/opengrader/compiled/` (or `$XDG_CACHE_HOME/opengrader/compiled/`).
+The files of an entry are written to a temporary folder, then renamed, so the
+threads (and concurrent runs) never see a partial entry. The entries used by a
+run get their mtime updated, and `evict` removes the least recently used ones
+while the cache is bigger than `max_size`.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_MAX_SIZE = 512  # MB
+ERROR_FILENAME = "error.txt"
+
+
+def default_cache_folder() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "opengrader" / "compiled"
+
+
+def folder_size(folder: Path) -> int:
+    return sum(f.stat().st_size for f in folder.rglob("*") if f.is_file())
+
+
+class CompileCache:
+    def __init__(self, folder=None, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Args:
+            folder: Folder of the cache (created if needed)
+            max_size: Size of the cache in MB, above which `evict` removes entries
+        """
+        self.folder = Path(folder) if folder else default_cache_folder()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(toolchain: str, command: List[str], sources: Dict[str, str]) -> str:
+        """Content address of the outputs of `command` compiling `sources` (filename -> content)."""
+        digest = hashlib.sha256()
+        for part in (toolchain, *command):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        for filename, content in sorted(sources.items()):
+            digest.update(f"{filename}\0{len(content)}\0".encode("utf-8"))
+            digest.update(content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def fetch(self, key: str, folder: Path) -> Optional[str]:
+        """Copy the outputs of the entry `key` into `folder`.
+
+        Returns:
+            None if the entry does not exist, the compilation error message if
+            the cached compilation failed, "" otherwise
+        """
+        entry = self.folder / key
+        try:
+            os.utime(entry)
+            names = os.listdir(entry)
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+        if ERROR_FILENAME in names:
+            return (entry / ERROR_FILENAME).read_text(encoding="utf-8")
+        for name in names:
+            source = entry / name
+            if source.is_dir():
+                shutil.copytree(source, folder / name, dirs_exist_ok=True)
+            else:
+                shutil.copyfile(source, folder / name)
+        return ""
+
+    def _store(self, key: str, fill):
+        tmp = self.folder / f".{key}.{uuid.uuid4().hex}.tmp"
+        tmp.mkdir()
+        try:
+            fill(tmp)
+            os.rename(tmp, self.folder / key)
+        except OSError:
+            # Stored meanwhile by another thread or run: same content
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def store(self, key: str, folder: Path, outputs: List[str]):
+        """Store the `outputs` (files or folders, relative to `folder`) as the entry `key`."""
+        def fill(entry: Path):
+            for name in outputs:
+                source = folder / name
+                if source.is_dir():
+                    shutil.copytree(source, entry / name)
+                else:
+                    shutil.copyfile(source, entry / name)
+        self._store(key, fill)
+
+    def store_error(self, key: str, message: str):
+        self._store(key, lambda entry: (entry / ERROR_FILENAME).write_text(message, encoding="utf-8"))
+
+    def evict(self) -> int:
+        """Remove the least recently used entries until the cache fits in `max_size`.
+
+        Returns:
+            Number of entries removed
+        """
+        entries = []
+        for entry in self.folder.iterdir():
+            try:
+                # Including the leftovers of interrupted runs (*.tmp)
+                entries.append((entry.stat().st_mtime, folder_size(entry), entry))
+            except FileNotFoundError:
+                continue
+
+        size = sum(s for _, s, _ in entries)
+        removed = 0
+        for _, entry_size, entry in sorted(entries, key=lambda e: e[0]):
+            if size <= self.max_size * 1024 * 1024:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            size -= entry_size
+            removed += 1
+        return removed
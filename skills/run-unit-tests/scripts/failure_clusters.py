@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Cluster the failing answers to a question by the way they fail its unit tests.
+
+Many students fail the same tests for the same reason. The signature of a
+failing answer is the status of its run, and the outcome of every test it did
+not pass with its normalized failure message: the numbers, quoted values and
+addresses are masked, so "assert 4 == 3" and "assert 5 == 3" are the same
+failure. Answers with the same signature form a cluster, numbered by
+decreasing size. The representative of a cluster is its answer of median
+length.
+
+Reviewing the representative of each cluster is enough to understand all the
+failures of a question: when writing the rubric, and when grading (the grade
+of the representative can be applied to the whole cluster, see `grader.py
+--failure-clusters`).
+
+The clusters are read from the results store of the exam (see
+`test_results.py`), written to the `unit_test_results` of the failing answers
+(`cluster`, and `representative: true` for the representatives), and printed:
+
+    question 2: 24 failing answers in 4 clusters (+ 3 answers failing their own way)
+      #1  12 answers, representative Jane_Doe
+          test_edge_empty: failed: AssertionError: assert mean([]) == <n>
+
+Usage:
+    python failure_clusters.py <exam_filepath> [-q ID ...] [--top N]
+"""
+
+import argparse
+import re
+import sys
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+SCRIPTS_FOLDER = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS_FOLDER / ".." / "assets"))
+
+import exam_store
+from test_results import AnswerResults, TestResultsStore, database_path
+
+
+# Masked parts of the failure messages, applied in order
+NORMALIZATIONS = [
+    (re.compile(r"0x[0-9a-fA-F]+"), "<addr>"),
+    (re.compile(r"'[^'\n]*'|\"[^\"\n]*\"|‘[^’\n]*’|`[^`\n]*`"), "<str>"),
+    (re.compile(r"-?\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b"), "<n>"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_message(message: Optional[str]) -> str:
+    """First line of a failure message, without the values that differ between answers."""
+    if not message:
+        return ""
+    res = message.strip().splitlines()[0]
+    for pattern, replacement in NORMALIZATIONS:
+        res = pattern.sub(replacement, res)
+    return res.strip()
+
+
+Signature = Tuple[str, str, Tuple[Tuple[str, str, str], ...]]
+
+
+def failure_signature(answer: AnswerResults, test_names: List[str]) -> Optional[Signature]:
+    """Signature of a failing answer (see the module docstring), None if it passed."""
+    if answer.status == "passed":
+        return None
+    failures = []
+    for name in test_names:
+        outcome, message = answer.outcome(name)
+        if outcome != "passed":
+            failures.append((name, outcome, normalize_message(message)))
+    return answer.status, normalize_message(answer.message), tuple(failures)
+
+
+@dataclass
+class FailureCluster:
+    number: int
+    signature: Signature
+    students: List[str] = field(default_factory=list)
+    representative: Optional[str] = None
+
+    def describe(self) -> List[str]:
+        """One line per failure of the signature."""
+        status, message, failures = self.signature
+        lines = [f"{status}: {message}"] if message else []
+        return lines + [f"{name}: {outcome}" + (f": {msg}" if msg else "") for name, outcome, msg in failures]
+
+
+def cluster_answers(
+    test_names: List[str], answers: List[AnswerResults], contents: Dict[str, str] = None
+) -> List[FailureCluster]:
+    """Group the failing `answers` by signature.
+
+    Args:
+        test_names: Tests of the question
+        answers: Results of the answers to the question (see `TestResultsStore.answer_results`)
+        contents: Student key -> answer content, to pick the representatives (the
+            first student of each cluster without it)
+
+    Returns:
+        The clusters, by decreasing size
+    """
+    groups: Dict[Signature, List[str]] = {}
+    for answer in answers:
+        signature = failure_signature(answer, test_names)
+        if signature is not None:
+            groups.setdefault(signature, []).append(answer.student)
+
+    clusters = []
+    ordered = sorted(groups.items(), key=lambda item: (-len(item[1]), item[1][0]))
+    for number, (signature, students) in enumerate(ordered, start=1):
+        representative = students[0]
+        if contents:
+            by_length = sorted(students, key=lambda s: (len(contents.get(s) or ""), s))
+            representative = by_length[(len(by_length) - 1) // 2]
+        clusters.append(FailureCluster(number, signature, students, representative))
+    return clusters
+
+
+def cluster_question(store: TestResultsStore, question_id: int, contents: Dict[str, str] = None) -> List[FailureCluster]:
+    return cluster_answers(*store.answer_results(question_id), contents)
+
+
+def annotate_answers(students: List[dict], clusters: Dict[int, List[FailureCluster]]) -> List[dict]:
+    """Write the clusters of `clusters` (question id -> clusters) in the answers of `students`.
+
+    The students of the clusters are the keys of `exam_store.student_keys(students)`.
+
+    Returns:
+        The students whose answers changed
+    """
+    assignments = {
+        (question_id, student): (cluster.number, student == cluster.representative)
+        for question_id, question_clusters in clusters.items()
+        for cluster in question_clusters
+        for student in cluster.students
+    }
+    keys = exam_store.student_keys(students)
+    changed = []
+    for student in students:
+        modified = False
+        for answer in student.get("answers") or []:
+            results = answer.get("unit_test_results")
+            if not results or answer.get("question_id") not in clusters:
+                continue
+            before = (results.get("cluster"), results.get("representative"))
+            results.pop("cluster", None)
+            results.pop("representative", None)
+            assignment = assignments.get((answer["question_id"], keys[id(student)]))
+            if assignment is not None:
+                results["cluster"], representative = assignment
+                if representative:
+                    results["representative"] = True
+            modified |= before != (results.get("cluster"), results.get("representative"))
+        if modified:
+            changed.append(student)
+    return changed
+
+
+def cluster_exam(exam_path, question_ids=None) -> Dict[int, List[FailureCluster]]:
+    """Cluster the failing answers of an exam, and record the clusters in it.
+
+    Args:
+        exam_path: Path to the exam YAML file, or to a sharded exam folder
+        question_ids: Only cluster these questions (defaults to all the tested ones)
+
+    Returns:
+        Dict question id -> clusters
+    """
+    exam_path = Path(exam_path)
+    sharded = exam_store.is_sharded(exam_path)
+    if sharded:
+        students = list(exam_store.iter_students(exam_path))
+    else:
+        data = exam_store.load_yaml_file(exam_path, cached=True)
+        students = data.get("student_response") or []
+
+    keys = exam_store.student_keys(students)
+    store = TestResultsStore(database_path(exam_path))
+    try:
+        clusters = {}
+        for question_id in question_ids or store.question_ids():
+            contents = {
+                keys[id(student)]: answer.get("content")
+                for student in students
+                for answer in student.get("answers") or []
+                if answer.get("question_id") == question_id
+            }
+            clusters[question_id] = cluster_question(store, question_id, contents)
+    finally:
+        store.close()
+
+    changed = annotate_answers(students, clusters)
+    if sharded:
+        for student in changed:
+            exam_store.save_student(exam_path, student)
+    elif changed:
+        exam_store.dump_yaml_file(data, exam_path)
+    return clusters
+
+
+def print_clusters(question_clusters: List[FailureCluster], name: str, top: int = 10):
+    shared = [c for c in question_clusters if len(c.students) > 1]
+    alone = len(question_clusters) - len(shared)
+    failing = sum(len(c.students) for c in question_clusters)
+    print(
+        f"{name}: {failing} failing answers in {len(shared)} clusters"
+        + (f" (+ {alone} answers failing their own way)" if alone else "")
+    )
+    for cluster in shared[:top]:
+        print(f"  #{cluster.number:<3} {len(cluster.students)} answers, representative {cluster.representative}")
+        for line in cluster.describe():
+            print(f"        {line[:160]}")
+    if len(shared) > top:
+        rest = Counter(len(c.students) for c in shared[top:])
+        print(f"  ... and {len(shared) - top} smaller clusters ({sum(n * k for n, k in rest.items())} answers)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster the failing answers of an exam by unit test failures")
+    parser.add_argument("exam_filepath", help="Exam YAML file path, or sharded exam folder")
+    parser.add_argument("-q", "--question", type=int, nargs="+", dest="question_ids",
+                        help="Only cluster these question ids")
+    parser.add_argument("--top", type=int, default=10,
+                        help="Number of clusters printed per question (default: 10)")
+    args = parser.parse_args()
+
+    if not database_path(args.exam_filepath).exists():
+        print(f"No test results for {args.exam_filepath}: run the unit tests first")
+        sys.exit(1)
+
+    clusters = cluster_exam(args.exam_filepath, set(args.question_ids) if args.question_ids else None)
+    header = exam_store.load_header(args.exam_filepath)
+    names = {q["id"]: q.get("name") for q in header.get("questions") or []}
+    for question_id, question_clusters in sorted(clusters.items()):
+        print_clusters(question_clusters, names.get(question_id) or f"question {question_id}", args.top)
+
+
+if __name__ == "__main__":
+    main()
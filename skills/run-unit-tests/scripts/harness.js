@@ -0,0 +1,144 @@
+#!/usr/bin/env node
+/*
+ * Run the unit tests of a JavaScript question against one student answer.
+ *
+ * Counterpart of `harness.py` for node, in the same sandbox:
+ *
+ * - The tests either call the functions of the answer directly (the answer and
+ *   the tests then run as two scripts of the same context), or get them with
+ *   `const { f } = require("./solution")` (the answer then runs in its own
+ *   context, and both `module.exports` and its top-level declarations are
+ *   visible through `require`).
+ * - The tests are the top-level `test*` functions, and the functions
+ *   registered with `test("name", fn)`, run in order. They use `assert` (the
+ *   node module, available as a global), and can be async.
+ *
+ * The results file gets the same records as with `harness.py`, including the
+ * `<load>` error.
+ *
+ * Usage:
+ *     node harness.js <solution.js> <tests.js> <results.jsonl>
+ */
+"use strict";
+
+const assert = require("assert");
+const dns = require("dns");
+const fs = require("fs");
+const net = require("net");
+const vm = require("vm");
+
+const MAX_MESSAGE_LENGTH = 500;
+const IDENTIFIER = /^[A-Za-z_$][\w$]*$/;
+const SOLUTION_MODULE = /^\.\/solution(\.js)?$/;
+const REQUIRES_SOLUTION = /require\(\s*["']\.\/solution(\.js)?["']\s*\)/;
+
+function blockNetwork() {
+  // Second line of defense when the sandbox could not isolate the network
+  const refuse = () => {
+    throw new Error("Network access is disabled during the tests");
+  };
+  net.Socket.prototype.connect = refuse;
+  net.Server.prototype.listen = refuse;
+  dns.lookup = refuse;
+}
+
+function errorMessage(error) {
+  // Errors thrown in a context are not instances of the Error of this one
+  const message = error && typeof error.message === "string"
+    ? `${error.name || "Error"}: ${error.message}`
+    : `Error: ${String(error)}`;
+  // The assertion messages of node span several lines (e.g. "... equal:\n\n1 !== 3")
+  return message.replace(/\s+/g, " ").trim().slice(0, MAX_MESSAGE_LENGTH);
+}
+
+function outcomeOf(error) {
+  return error && (error.name === "AssertionError" || error.code === "ERR_ASSERTION") ? "failed" : "error";
+}
+
+function makeContext(registered, requireSolution) {
+  const silent = { log() {}, info() {}, warn() {}, error() {}, debug() {} };
+  const module = { exports: {} };
+  const context = vm.createContext({
+    assert,
+    console: silent,
+    module,
+    exports: module.exports,
+    test: (name, fn) => registered.push([String(name), fn]),
+    setTimeout, clearTimeout, setInterval, clearInterval, setImmediate, queueMicrotask,
+  });
+  context.require = (name) => (SOLUTION_MODULE.test(name) ? requireSolution() : require(name));
+  return context;
+}
+
+function exportsOf(context) {
+  // `module.exports` first, then the top-level declarations of the answer
+  return new Proxy({}, {
+    get(_, key) {
+      const exported = context.module.exports;
+      if (exported && typeof exported === "object" && key in exported) return exported[key];
+      if (typeof key !== "string" || !IDENTIFIER.test(key)) return undefined;
+      return vm.runInContext(`typeof ${key} === "undefined" ? undefined : ${key}`, context);
+    },
+  });
+}
+
+async function run(solutionPath, testsPath, resultsPath) {
+  const results = fs.openSync(resultsPath, "a");
+  const record = (name, outcome, duration, message = null) => {
+    const line = { name, outcome, duration: Math.round(duration * 1e6) / 1e6, message };
+    fs.writeSync(results, JSON.stringify(line) + "\n");
+  };
+  const now = () => Number(process.hrtime.bigint()) / 1e9;
+
+  const registered = [];
+  let start = now();
+  let testsContext;
+  try {
+    const solution = fs.readFileSync(solutionPath, "utf-8");
+    const tests = fs.readFileSync(testsPath, "utf-8");
+    const requireSolution = () => exportsOf(solutionContext);
+    const solutionContext = makeContext(registered, requireSolution);
+    testsContext = REQUIRES_SOLUTION.test(tests) ? makeContext(registered, requireSolution) : solutionContext;
+    vm.runInContext(solution, solutionContext, { filename: "solution.js" });
+    vm.runInContext(tests, testsContext, { filename: "tests.js" });
+  } catch (e) {
+    record("<load>", "error", now() - start, errorMessage(e));
+    return;
+  }
+
+  const declared = Object.keys(testsContext)
+    .filter((name) => name.startsWith("test") && name !== "test" && typeof testsContext[name] === "function")
+    .map((name) => [name, testsContext[name]]);
+
+  const collected = [...declared, ...registered];
+  for (const [name] of collected) record(name, "collected", 0);
+
+  for (const [name, fn] of collected) {
+    start = now();
+    let outcome = "passed";
+    let message = null;
+    try {
+      await fn();
+    } catch (e) {
+      outcome = outcomeOf(e);
+      message = errorMessage(e);
+    }
+    record(name, outcome, now() - start, message);
+  }
+}
+
+async function main() {
+  const args = process.argv.slice(2);
+  if (args.length !== 3) {
+    process.stderr.write("Usage: node harness.js <solution.js> <tests.js> <results.jsonl>\n");
+    process.exit(2);
+  }
+  blockNetwork();
+  // Rejected promises the answer forgot: only the awaited ones matter
+  process.on("unhandledRejection", () => {});
+  await run(...args);
+  // Do not wait for the timers left by the answer
+  process.exit(0);
+}
+
+main();
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Run the unit tests of a question against one student answer.
+
+This script runs inside the sandbox (see `sandbox.py`), in a temporary folder
+containing only the answer and the tests. It does not need pytest:
+
+- The answer is executed as the module `solution`, so the tests can either
+  `from solution import ...` or call its functions directly (the tests run in a
+  copy of the namespace of the answer).
+- The tests are the `test_*` functions (plain `assert`s) and the methods of the
+  `unittest.TestCase` classes defined by the tests file, run in order.
+
+Once the tests are loaded, one record per test with the outcome `collected` is
+appended to the results file, then one JSON object per test as soon as the
+test ends, so the results of the finished tests survive a timeout:
+    {"name": "test_empty", "outcome": "passed" | "failed" | "error", "duration": 0.01, "message": null}
+The runner marks the collected tests without a result as not run.
+
+A failure to load the answer or the tests is reported as a single record named
+`<load>` with the outcome `error`.
+
+The answer runs in the same process and folder as the harness: it can write
+records of its own, or patch the harness and the tests. The sandbox protects
+the machine, not the results, which are a pre-grading aid and must not be
+trusted as a proof that an answer is correct.
+
+Usage:
+    python harness.py <solution.py> <tests.py> <results.jsonl>
+"""
+
+import json
+import socket
+import sys
+import time
+import traceback
+import types
+import unittest
+
+
+MAX_MESSAGE_LENGTH = 500
+
+
+def block_network():
+    """Second line of defense when the sandbox could not isolate the network."""
+    def refuse(*args, **kwargs):
+        raise OSError("Network access is disabled during the tests")
+
+    socket.socket.connect = refuse
+    socket.socket.connect_ex = refuse
+    socket.socket.bind = refuse
+    socket.create_connection = refuse
+    socket.getaddrinfo = refuse
+
+
+def error_message(error: BaseException) -> str:
+    message = f"{type(error).__name__}: {error}".strip()
+    if isinstance(error, AssertionError) and not str(error):
+        # Bare `assert`: show the failing line instead
+        frames = traceback.extract_tb(error.__traceback__)
+        if frames:
+            message = f"AssertionError: {frames[-1].line}"
+    return message[:MAX_MESSAGE_LENGTH]
+
+
+def outcome_of(error: BaseException) -> str:
+    return "failed" if isinstance(error, AssertionError) else "error"
+
+
+def load_module(name: str, filepath: str, namespace: dict) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__file__ = filepath
+    module.__dict__.update(namespace)
+    sys.modules[name] = module
+    with open(filepath, "r", encoding="utf-8") as f:
+        code = compile(f.read(), filepath, "exec")
+    exec(code, module.__dict__)
+    return module
+
+
+def collect_tests(module: types.ModuleType):
+    """Yield (name, callable) for every test of `module`, in order of definition."""
+    for name, value in list(vars(module).items()):
+        if name.startswith("test") and isinstance(value, types.FunctionType):
+            if value.__module__ == module.__name__:
+                yield name, value
+        elif (
+            isinstance(value, type)
+            and issubclass(value, unittest.TestCase)
+            and value.__module__ == module.__name__
+        ):
+            for method in unittest.TestLoader().getTestCaseNames(value):
+                yield f"{name}.{method}", value(method)
+
+
+def run_test(test) -> tuple:
+    """Run a test function or a TestCase. Returns (outcome, message)."""
+    if isinstance(test, unittest.TestCase):
+        result = unittest.TestResult()
+        test.run(result)
+        for outcome, problems in (("failed", result.failures), ("error", result.errors)):
+            if problems:
+                lines = problems[0][1].strip().splitlines()
+                return outcome, (lines[-1] if lines else outcome)[:MAX_MESSAGE_LENGTH]
+        return "passed", None
+
+    try:
+        test()
+        return "passed", None
+    except Exception as e:
+        return outcome_of(e), error_message(e)
+
+
+def run(solution_filepath: str, tests_filepath: str, results_filepath: str):
+    results = open(results_filepath, "a", encoding="utf-8")
+
+    def record(name, outcome, duration, message=None):
+        results.write(json.dumps(
+            {"name": name, "outcome": outcome, "duration": round(duration, 6), "message": message}
+        ) + "\n")
+        results.flush()
+
+    start = time.perf_counter()
+    try:
+        solution = load_module("solution", solution_filepath, {})
+        tests = load_module("tests", tests_filepath, dict(vars(solution), __name__="tests"))
+    except BaseException as e:
+        record("<load>", "error", time.perf_counter() - start, error_message(e))
+        return
+
+    collected = list(collect_tests(tests))
+    for name, _ in collected:
+        record(name, "collected", 0.0)
+
+    for name, test in collected:
+        start = time.perf_counter()
+        try:
+            outcome, message = run_test(test)
+        except BaseException as e:
+            # SystemExit, KeyboardInterrupt... raised by the answer
+            outcome, message = "error", error_message(e)
+        record(name, outcome, time.perf_counter() - start, message)
+
+
+def main():
+    if len(sys.argv) != 4:
+        print(__doc__)
+        sys.exit(2)
+    block_network()
+    # The answers print a lot: keep the output of the tests out of the way
+    sys.stdout = open("stdout.txt", "w", encoding="utf-8")
+    run(*sys.argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+// Minimal unit test framework for the C++ questions (see `harness_main.cpp`).
+//
+// The tests of a question are written as:
+//
+//     int add(int a, int b);  // Prototypes of the functions of the answer
+//
+//     TEST(test_small) {
+//         CHECK(add(1, 2) == 3);
+//         CHECK_EQ(add(-1, -2), -3);
+//     }
+//
+// This header is included automatically at the top of the tests.
+#pragma once
+
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+namespace opengrader {
+
+struct TestCase {
+    const char* name;
+    void (*function)();
+};
+
+// Failed CHECK: reported as a failed test, any other exception as an error
+struct AssertionFailure : std::runtime_error {
+    explicit AssertionFailure(const std::string& message) : std::runtime_error(message) {}
+};
+
+std::vector<TestCase>& tests();
+
+struct Registrar {
+    Registrar(const char* name, void (*function)()) { tests().push_back({name, function}); }
+};
+
+template <typename A, typename B>
+std::string describe_mismatch(const A& actual, const B& expected) {
+    std::ostringstream out;
+    out << actual << " != " << expected;
+    return out.str();
+}
+
+}  // namespace opengrader
+
+#define TEST(name)                                                            \
+    static void name();                                                       \
+    static opengrader::Registrar name##_registrar(#name, name);               \
+    static void name()
+
+#define CHECK(condition)                                                      \
+    do {                                                                      \
+        if (!(condition))                                                     \
+            throw opengrader::AssertionFailure("CHECK(" #condition ") failed"); \
+    } while (0)
+
+#define CHECK_EQ(actual, expected)                                            \
+    do {                                                                      \
+        const auto& og_actual = (actual);                                     \
+        const auto& og_expected = (expected);                                 \
+        if (!(og_actual == og_expected))                                      \
+            throw opengrader::AssertionFailure(                               \
+                "CHECK_EQ(" #actual ", " #expected ") failed: " +            \
+                opengrader::describe_mismatch(og_actual, og_expected));       \
+    } while (0)
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Run the unit tests of the questions against the answers of the students.
+
+For every (student, question) where the question has `unit_tests`, the
+backend of the question type (see `backends.py`: python, javascript, java,
+cpp) builds the answer in a temporary folder and runs the tests against it, in
+a sandboxed process (see `sandbox.py`: CPU, memory and file size limits, no
+network). The Python tests run in children forked by warm workers (see
+`worker.py`). The tests of each question are prepared (compiled) once, the
+answers are built and tested in parallel, and the results are recorded in the
+`unit_test_results` field of each answer:
+
+    unit_test_results:
+      status: failed          # passed, failed, error (the answer does not compile or could not be loaded), timeout,
+                              # crashed (including an exit before the end of the tests)
+      passed: 4
+      failed: 2
+      total: 6
+      failed_tests: [test_empty, test_negative]
+
+Usage:
+    python run_unit_tests.py <exam_filepath> [-j JOBS] [--time-limit SECONDS] [--memory-limit MB] [-q ID ...]
+
+Arguments:
+    exam_filepath    Path to the exam YAML file, or to a sharded exam folder
+                     (see `assets/exam_store.py`)
+
+Options:
+    -j, --jobs          Number of answers built and tested in parallel (default: number of cores)
+    --time-limit        CPU time limit of the tests of one answer, in seconds (default: 10)
+    --memory-limit      Memory limit of the tests of one answer, in MB (default: 512)
+    -q, --question      Only run the tests of these question ids (default: all)
+    --cold              Start a new interpreter for every Python answer. By default,
+                        the tests run in warm worker processes (see `worker.py`),
+                        forking a sandboxed child per answer (Linux only, the
+                        other systems always start a new interpreter)
+    --no-cache          Compile every answer again. By default, the answers (and
+                        tests) that did not change since a previous run are not
+                        compiled again (see `compile_cache.py`)
+    --cache-size        Size of the compilation cache, in MB (default: 512). The
+                        least recently used entries are removed above it
+
+Notes:
+    - Python tests are `test_*` functions using `assert`, or `unittest.TestCase` classes.
+      They can `from solution import ...`, or call the functions of the answer directly.
+      See the harness of each language for the tests of the other types
+    - The questions whose toolchain (node, javac / java, g++) is not installed are
+      skipped, and listed at the end
+    - A run is stopped after twice its CPU time limit of wall time (e.g. an answer
+      sleeping or waiting for input)
+    - Students of a sharded exam are saved as soon as all their answers are tested,
+      a single-file exam is saved once at the end
+    - The result of every test (duration, failure message) is also recorded in a
+      SQLite database next to the exam, see `test_results.py` to explore it
+    - The results are written by the harness, in the process of the answer: an
+      answer can tamper with them (see `harness.py`)
+"""
+
+import argparse
+import json
+import os
+import re
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ruamel.yaml.comments import CommentedMap, CommentedSeq
+
+SCRIPTS_FOLDER = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS_FOLDER / ".." / "assets"))
+
+import exam_store
+from backends import BACKENDS, Backend, BuildError, available_backends
+from compile_cache import DEFAULT_MAX_SIZE, CompileCache
+from test_results import TestResultsStore, database_path
+from worker import WorkerPool, pool_available
+
+
+DEFAULT_TIME_LIMIT = 10
+DEFAULT_MEMORY_LIMIT = 512
+# Line of a crash output giving its reason, e.g. "MemoryError", "FATAL ERROR: ..."
+ERROR_MESSAGE = re.compile(r"\b(?:\w*Error|ERROR|error)\b(?::|$)")
+
+
+@dataclass
+class TestJob:
+    student: dict
+    question: dict
+    answer: dict
+
+
+@dataclass
+class TestOutcome:
+    name: str
+    outcome: str
+    duration: float
+    message: Optional[str] = None
+
+
+@dataclass
+class TestRun:
+    status: str
+    tests: List[TestOutcome] = field(default_factory=list)
+    duration: float = 0.0
+    message: Optional[str] = None
+
+    def count(self, outcome: str) -> int:
+        return sum(1 for t in self.tests if t.outcome == outcome)
+
+    def to_yaml(self) -> CommentedMap:
+        failed_tests = CommentedSeq(t.name for t in self.tests if t.outcome != "passed")
+        failed_tests.fa.set_flow_style()
+        res = CommentedMap()
+        res["status"] = self.status
+        res["passed"] = self.count("passed")
+        res["failed"] = len(self.tests) - self.count("passed")
+        res["total"] = len(self.tests)
+        res["failed_tests"] = failed_tests
+        if self.message:
+            res["message"] = self.message
+        return res
+
+
+def read_results(filepath: Path) -> List[TestOutcome]:
+    tests = []
+    if not filepath.exists():
+        return tests
+    for line in filepath.read_text(encoding="utf-8").splitlines():
+        try:
+            tests.append(TestOutcome(**json.loads(line)))
+        except (ValueError, TypeError):
+            # Last line cut by a kill
+            continue
+    return tests
+
+
+def make_run(records: List[TestOutcome], returncode: int, timed_out: bool, stderr: str, duration: float) -> TestRun:
+    """Build the result of a run from its records and the way its process ended.
+
+    The collected tests without a result are recorded with the outcome `not
+    run`. A run that did not reach the end of its tests is never `passed`, even
+    when its process exited with 0 (e.g. `os._exit(0)` in the answer).
+    """
+    load_errors = [t for t in records if t.name == "<load>"]
+    if load_errors:
+        return TestRun(status="error", duration=duration, message=load_errors[0].message)
+
+    results = {t.name: t for t in records if t.outcome != "collected"}
+    tests = [
+        results.pop(t.name, TestOutcome(t.name, "not run", 0.0))
+        for t in records
+        if t.outcome == "collected"
+    ]
+    run = TestRun(status="passed", tests=tests + list(results.values()), duration=duration)
+    if timed_out or returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        run.status = "timeout"
+    elif returncode != 0:
+        run.status = "crashed"
+        lines = stderr.strip().splitlines()
+        # Python tracebacks end with the error, node prints a stack after it
+        errors = [line for line in lines if ERROR_MESSAGE.search(line)]
+        run.message = (errors or lines)[-1][:500] if lines else f"Exit code {returncode}"
+    elif not run.tests or any(t.outcome == "not run" for t in run.tests):
+        run.status = "crashed"
+        run.message = "The tests stopped before the end (exit code 0)" if run.tests else "No test was run (exit code 0)"
+    elif any(t.outcome != "passed" for t in run.tests):
+        run.status = "failed"
+    return run
+
+
+def prepare_question(backend: Backend, question: dict, folder: Path, cache: CompileCache = None) -> Path:
+    """Prepare the tests of `question` once, in a subfolder of `folder` shared by its answers."""
+    prepared = folder / f"question-{question['id']}"
+    prepared.mkdir()
+    try:
+        backend.prepare(question["unit_tests"], prepared, cache)
+    except BuildError as e:
+        raise RuntimeError(f"The tests of question {question['id']} cannot be used: {e}") from e
+    return prepared
+
+
+def test_answer(
+    backend: Backend,
+    answer: str,
+    prepared: Path,
+    time_limit: int,
+    memory_limit: int,
+    pool: WorkerPool = None,
+    cache: CompileCache = None,
+) -> TestRun:
+    """Build `answer` and run the tests prepared in `prepared` against it, in a sandbox.
+
+    Args:
+        pool: Warm workers to run the Python tests in (see `worker.py`). Without
+            it, a new interpreter is started for the answer.
+        cache: Compiled answers of the previous runs (see `compile_cache.py`)
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="opengrader-tests-") as folder:
+        folder = Path(folder)
+        try:
+            backend.build(answer or "", folder, prepared, cache)
+        except BuildError as e:
+            return TestRun(status="error", duration=time.perf_counter() - start, message=str(e))
+
+        returncode, timed_out, stderr = backend.run(folder, prepared, time_limit, memory_limit, pool)
+        tests_run = read_results(folder / "results.jsonl")
+
+    return make_run(tests_run, returncode, timed_out, stderr, time.perf_counter() - start)
+
+
+def run_job(
+    job: TestJob,
+    prepared: Future,
+    time_limit: int,
+    memory_limit: int,
+    pool: WorkerPool = None,
+    cache: CompileCache = None,
+) -> TestRun:
+    backend = BACKENDS[job.question["type"]]
+    return test_answer(
+        backend, job.answer.get("content"), prepared.result(), time_limit, memory_limit, pool, cache
+    )
+
+
+def testable_questions(questions: List[dict], question_ids=None) -> Dict[int, dict]:
+    """Questions with unit tests, by id, whatever their type."""
+    return {
+        q["id"]: q
+        for q in questions
+        if q.get("unit_tests") and (question_ids is None or q["id"] in question_ids)
+    }
+
+
+def skipped_questions(questions: List[dict], question_ids=None) -> Dict[int, str]:
+    """Questions with unit tests that cannot be tested here, by id, with the reason."""
+    supported = available_backends()
+    skipped = {}
+    for question_id, q in testable_questions(questions, question_ids).items():
+        backend = BACKENDS.get(q.get("type"))
+        if backend is None:
+            skipped[question_id] = f"no test backend for the type {q.get('type')!r}"
+        elif q["type"] not in supported:
+            skipped[question_id] = f"{', '.join(backend.executables)} not found in the PATH"
+    return skipped
+
+
+def collect_jobs(questions: List[dict], students: List[dict], question_ids=None) -> List[TestJob]:
+    supported = available_backends()
+    testable = {
+        question_id: q
+        for question_id, q in testable_questions(questions, question_ids).items()
+        if q.get("type") in supported
+    }
+    return [
+        TestJob(student, testable[answer["question_id"]], answer)
+        for student in students
+        for answer in student.get("answers") or []
+        if answer.get("question_id") in testable
+    ]
+
+
+def run_tests(
+    questions: List[dict],
+    students: List[dict],
+    jobs: int = None,
+    time_limit: int = DEFAULT_TIME_LIMIT,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    question_ids=None,
+    on_student=None,
+    warm: bool = True,
+    use_cache: bool = True,
+    cache_size: int = DEFAULT_MAX_SIZE,
+    store: TestResultsStore = None,
+) -> Dict[tuple, str]:
+    """Run the unit tests of `questions` against the answers of `students`, in place.
+
+    Args:
+        questions: Questions of the exam
+        students: Students, the `unit_test_results` of their answers are updated
+        jobs: Number of answers built and tested in parallel (defaults to the number of cores)
+        time_limit: CPU time limit of one answer, in seconds
+        memory_limit: Memory limit of one answer, in MB
+        question_ids: Only test these questions (defaults to all)
+        on_student: Called with each student once all their answers are tested
+        warm: Run the Python tests in warm worker processes (see `worker.py`),
+            instead of starting an interpreter for every answer
+        use_cache: Reuse the compilations of the previous runs (see `compile_cache.py`)
+        cache_size: Size of the compilation cache, in MB
+        store: Where to record the result of every test (see `test_results.py`)
+
+    Returns:
+        Dict (firstname, lastname, question_id) -> error message, for the runs
+        that could not be started
+    """
+    test_jobs = collect_jobs(questions, students, question_ids)
+    pending = {}
+    for job in test_jobs:
+        pending[id(job.student)] = pending.get(id(job.student), 0) + 1
+
+    # Rows of the results store, unique even for students with the same name
+    keys = exam_store.student_keys(students)
+    failures = {}
+    done = 0
+    start = time.perf_counter()
+    jobs = jobs or os.cpu_count()
+    uses_python = any(job.question["type"] == "python" for job in test_jobs)
+    pool = WorkerPool(jobs) if warm and uses_python and pool_available() else None
+    cache = CompileCache(max_size=cache_size) if use_cache else None
+    try:
+        with tempfile.TemporaryDirectory(prefix="opengrader-questions-") as folder, \
+                ThreadPoolExecutor(max_workers=jobs) as executor:
+            # Submitted first, so they never wait behind the answers that need them
+            prepared = {}
+            for job in test_jobs:
+                question = job.question
+                if question["id"] not in prepared:
+                    prepared[question["id"]] = executor.submit(
+                        prepare_question, BACKENDS[question["type"]], question, Path(folder), cache
+                    )
+            futures = {
+                executor.submit(
+                    run_job, job, prepared[job.question["id"]], time_limit, memory_limit, pool, cache
+                ): job
+                for job in test_jobs
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    run = future.result()
+                    job.answer["unit_test_results"] = run.to_yaml()
+                    if store is not None:
+                        store.record(keys[id(job.student)], job.question["id"], run)
+                except Exception as e:
+                    key = (job.student.get("firstname"), job.student.get("lastname"), job.question["id"])
+                    failures[key] = str(e)
+
+                done += 1
+                print(f"\rTested {done}/{len(test_jobs)} answers", end="", flush=True)
+                pending[id(job.student)] -= 1
+                if pending[id(job.student)] == 0 and on_student is not None:
+                    on_student(job.student)
+    finally:
+        if pool is not None:
+            pool.close()
+        if cache is not None:
+            cache.evict()
+
+    if test_jobs:
+        print()
+    print(f"Tested {len(test_jobs)} answers in {time.perf_counter() - start:.1f}s")
+    if cache is not None and cache.hits + cache.misses:
+        print(f"Compilation cache: {cache.hits} reused, {cache.misses} compiled")
+    return failures
+
+
+def run_exam_tests(exam_path, **kwargs) -> Dict[tuple, str]:
+    """Run the unit tests of an exam and record the results in it.
+
+    The result of every test is also recorded in the results store of the exam
+    (see `test_results.py`).
+
+    Args:
+        exam_path: Path to the exam YAML file, or to a sharded exam folder
+        **kwargs: See `run_tests`
+    """
+    exam_path = Path(exam_path)
+    store = TestResultsStore(database_path(exam_path))
+    try:
+        if exam_store.is_sharded(exam_path):
+            data = exam_store.load_header(exam_path)
+            students = list(exam_store.iter_students(exam_path))
+            return run_tests(
+                data.get("questions") or [],
+                students,
+                on_student=lambda student: exam_store.save_student(exam_path, student),
+                store=store,
+                **kwargs,
+            )
+
+        data = exam_store.load_yaml_file(exam_path, cached=True)
+        failures = run_tests(
+            data.get("questions") or [], data.get("student_response") or [], store=store, **kwargs
+        )
+        exam_store.dump_yaml_file(data, exam_path)
+        return failures
+    finally:
+        store.close()
+
+
+def print_summary(exam_path, top: int = 3):
+    """Print the number of answers by status, and the `top` most failed tests, for every tested question."""
+    data = exam_store.load_header(exam_path)
+    names = {q["id"]: q.get("name", q["id"]) for q in data.get("questions") or []}
+    statuses = {}
+    for student in exam_store.iter_students(exam_path):
+        for answer in student.get("answers") or []:
+            results = answer.get("unit_test_results")
+            if results:
+                counts = statuses.setdefault(answer["question_id"], {})
+                counts[results["status"]] = counts.get(results["status"], 0) + 1
+    store = TestResultsStore(database_path(exam_path))
+    try:
+        for question_id, counts in sorted(statuses.items()):
+            details = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+            print(f"  - {names.get(question_id, question_id)}: {details}")
+            failing = [t for t in store.question_report(question_id).tests.values() if t.failed]
+            for failures in failing[:top]:
+                print(f"      {failures.name}: {failures.rate:.0%} fail ({failures.failed}/{failures.total})")
+    finally:
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the unit tests of an exam against the student answers")
+    parser.add_argument("exam_filepath", help="Exam YAML file path, or sharded exam folder")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of answers tested in parallel (default: number of cores)")
+    parser.add_argument("--time-limit", type=int, default=DEFAULT_TIME_LIMIT,
+                        help=f"CPU time limit of one answer, in seconds (default: {DEFAULT_TIME_LIMIT})")
+    parser.add_argument("--memory-limit", type=int, default=DEFAULT_MEMORY_LIMIT,
+                        help=f"Memory limit of one answer, in MB (default: {DEFAULT_MEMORY_LIMIT})")
+    parser.add_argument("--cold", action="store_true",
+                        help="Start a new interpreter for every answer instead of using warm workers")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Compile every answer again, ignoring the compilation cache")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_SIZE,
+                        help=f"Size of the compilation cache, in MB (default: {DEFAULT_MAX_SIZE})")
+    parser.add_argument("-q", "--question", type=int, nargs="+", dest="question_ids",
+                        help="Only run the tests of these question ids")
+    args = parser.parse_args()
+
+    failures = run_exam_tests(
+        args.exam_filepath,
+        jobs=args.jobs,
+        time_limit=args.time_limit,
+        memory_limit=args.memory_limit,
+        question_ids=set(args.question_ids) if args.question_ids else None,
+        warm=not args.cold,
+        use_cache=not args.no_cache,
+        cache_size=args.cache_size,
+    )
+    print_summary(args.exam_filepath)
+
+    header = exam_store.load_header(args.exam_filepath)
+    skipped = skipped_questions(header.get("questions") or [], set(args.question_ids) if args.question_ids else None)
+    for question_id, reason in skipped.items():
+        print(f"Question {question_id} not tested: {reason}")
+
+    if failures:
+        print(f"{len(failures)} answer(s) could not be tested:")
+        for (firstname, lastname, question_id), error in failures.items():
+            print(f"  - {firstname} {lastname}, question {question_id}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
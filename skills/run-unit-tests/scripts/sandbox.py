@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Run a command with resource limits and without network access.
+
+The limits are applied to the current process, which is then replaced by the
+command (so they are inherited by it and all its children):
+- CPU time, memory (address space), size of the written files, open files
+- Network: the command runs in its own (empty) network namespace when the
+  kernel allows unprivileged user namespaces. Otherwise the network is left
+  available, and the harness of the tests blocks sockets in Python.
+
+Usage:
+    python sandbox.py [--cpu SECONDS] [--memory MB] [--file-size MB] [--open-files N] -- <command> [args...]
+"""
+
+import argparse
+import os
+import resource
+import sys
+
+
+def set_limit(limit, value):
+    """Lower a resource limit, never above the current hard limit."""
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, value))
+
+
+def isolate_network() -> bool:
+    """Move to a new network namespace (only a loopback, down). Returns whether it worked."""
+    try:
+        os.unshare(os.CLONE_NEWUSER | os.CLONE_NEWNET)
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+def apply_limits(cpu: int = None, memory: int = None, file_size: int = None, open_files: int = 64):
+    """
+    Args:
+        cpu: CPU time limit in seconds
+        memory: Address space limit in MB
+        file_size: Maximum size of a written file in MB
+        open_files: Maximum number of open files
+    """
+    if cpu:
+        set_limit(resource.RLIMIT_CPU, cpu)
+    if memory:
+        set_limit(resource.RLIMIT_AS, memory * 1024 * 1024)
+    if file_size:
+        set_limit(resource.RLIMIT_FSIZE, file_size * 1024 * 1024)
+    if open_files:
+        set_limit(resource.RLIMIT_NOFILE, open_files)
+    # No core dumps of crashing answers
+    set_limit(resource.RLIMIT_CORE, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a command with resource limits and no network")
+    parser.add_argument("--cpu", type=int, help="CPU time limit (seconds)")
+    parser.add_argument("--memory", type=int, help="Memory limit (MB)")
+    parser.add_argument("--file-size", type=int, default=16, help="Maximum size of a written file (MB)")
+    parser.add_argument("--open-files", type=int, default=64, help="Maximum number of open files")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run, after --")
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("No command given")
+
+    isolate_network()
+    apply_limits(cpu=args.cpu, memory=args.memory, file_size=args.file_size, open_files=args.open_files)
+    os.execvp(command[0], command)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Store of the unit test results of an exam, one row per test of every answer.
+
+The `unit_test_results` of an answer in the exam YAML only keep the counts and
+the names of the failed tests. The runner (see `run_unit_tests.py`) also
+records every test in a SQLite database next to the exam, with its duration
+and failure message, so the results can be explored without running the tests
+again, e.g. when writing the rubric of a question:
+
+    question 2: 31 answers
+      pass rate: 0%: 3, 1-24%: 0, 25-49%: 2, 50-74%: 5, 75-99%: 14, 100%: 7
+      test_edge_empty: 80% fail (25/31)
+        19 x AssertionError: assert mean([]) == 0
+         3 x ZeroDivisionError: division by zero
+
+Tables:
+    runs          (student, question_id) -> status, duration, message of the run
+    test_results  (student, question_id, test_name) -> outcome, duration, message
+
+The `student` of the rows is its key given by `exam_store.student_keys`: the
+name of its file in the sharded layout (`Jose_Diaz`, `Jose_Diaz-2`), unique
+even for the students with the same name.
+
+The database of `exam.yaml` is `exam.unit_tests.db`, the one of a sharded exam
+folder is `unit_tests.db` inside it. Running the tests of an answer again
+replaces its rows.
+
+Usage:
+    python test_results.py <exam_filepath> [-q ID ...] [--top N]
+"""
+
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+SCRIPTS_FOLDER = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS_FOLDER / ".." / "assets"))
+
+import exam_store
+
+
+DATABASE_FILENAME = "unit_tests.db"
+
+# Pass rate buckets of the histograms: (label, lowest rate, highest rate)
+PASS_RATE_BUCKETS = [
+    ("0%", 0.0, 0.0),
+    ("1-24%", 0.0, 0.25),
+    ("25-49%", 0.25, 0.5),
+    ("50-74%", 0.5, 0.75),
+    ("75-99%", 0.75, 1.0),
+    ("100%", 1.0, 1.0),
+]
+
+
+def database_path(exam_path) -> Path:
+    """SQLite file of the results of an exam (YAML file or sharded folder)."""
+    exam_path = Path(exam_path)
+    if exam_store.is_sharded(exam_path):
+        return exam_path / DATABASE_FILENAME
+    return exam_path.with_name(f"{exam_path.stem}.{DATABASE_FILENAME}")
+
+
+def pass_rate_bucket(rate: float) -> str:
+    if rate <= 0:
+        return PASS_RATE_BUCKETS[0][0]
+    if rate >= 1:
+        return PASS_RATE_BUCKETS[-1][0]
+    for label, low, high in PASS_RATE_BUCKETS[1:-1]:
+        if low <= rate < high:
+            return label
+    return PASS_RATE_BUCKETS[0][0]
+
+
+@dataclass
+class TestFailures:
+    """How the answers to a question fail one of its tests."""
+
+    name: str
+    failed: int = 0
+    total: int = 0
+    # Failure message -> number of answers, "<status>" for the runs without a row for the test (load error)
+    messages: Counter = field(default_factory=Counter)
+
+    @property
+    def rate(self) -> float:
+        return self.failed / self.total if self.total else 0.0
+
+
+@dataclass
+class AnswerResults:
+    """Results of the tests of one answer, as recorded by the runner."""
+
+    student: str
+    status: str
+    message: Optional[str] = None
+    # Test name -> (outcome, message)
+    tests: Dict[str, Tuple[str, Optional[str]]] = field(default_factory=dict)
+
+    def outcome(self, test_name: str) -> Tuple[str, Optional[str]]:
+        """(outcome, message) of a test, ("<status>", None) if the run has no row for it (load error)."""
+        return self.tests.get(test_name, (f"<{self.status}>", None))
+
+
+@dataclass
+class QuestionReport:
+    question_id: int
+    answers: int = 0
+    statuses: Counter = field(default_factory=Counter)
+    # Bucket label -> number of answers, in the order of PASS_RATE_BUCKETS
+    pass_rates: Dict[str, int] = field(default_factory=lambda: {b[0]: 0 for b in PASS_RATE_BUCKETS})
+    # Test name -> failures, in order of decreasing failure rate
+    tests: Dict[str, TestFailures] = field(default_factory=dict)
+
+
+class TestResultsStore:
+    def __init__(self, database_path):
+        self.database_path = Path(database_path)
+        # Written from the main thread of the runner, read by the reports
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.database_path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS runs (
+                    student TEXT NOT NULL,
+                    question_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    message TEXT,
+                    recorded_at REAL NOT NULL,
+                    PRIMARY KEY (question_id, student)
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS test_results (
+                    student TEXT NOT NULL,
+                    question_id INTEGER NOT NULL,
+                    test_name TEXT NOT NULL,
+                    outcome TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    message TEXT,
+                    PRIMARY KEY (question_id, student, test_name)
+                )"""
+            )
+
+    def record(self, student: str, question_id: int, run):
+        """Replace the results of the answer of `student` to a question by `run` (a TestRun)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM test_results WHERE question_id = ? AND student = ?", (question_id, student)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO runs (student, question_id, status, duration, message, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (student, question_id, run.status, run.duration, run.message, time.time()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO test_results "
+                "(student, question_id, test_name, outcome, duration, message) VALUES (?, ?, ?, ?, ?, ?)",
+                [(student, question_id, t.name, t.outcome, t.duration, t.message) for t in run.tests],
+            )
+
+    def question_ids(self) -> List[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT question_id FROM runs ORDER BY question_id").fetchall()
+        return [row[0] for row in rows]
+
+    def failures(self, question_id: int, test_name: str) -> List[Tuple[str, str, Optional[str]]]:
+        """(student, outcome, message) of the answers to a question not passing one of its tests.
+
+        The tests a run did not reach have the outcome "not run", and the answers
+        that could not be loaded have the outcome "<status>".
+        """
+        with self._lock:
+            return self._conn.execute(
+                """SELECT r.student, COALESCE(t.outcome, '<' || r.status || '>'), COALESCE(t.message, r.message)
+                FROM runs r
+                LEFT JOIN test_results t
+                    ON t.question_id = r.question_id AND t.student = r.student AND t.test_name = ?
+                WHERE r.question_id = ? AND (t.outcome IS NULL OR t.outcome != 'passed')
+                ORDER BY r.student""",
+                (test_name, question_id),
+            ).fetchall()
+
+    def answer_results(self, question_id: int) -> Tuple[List[str], List[AnswerResults]]:
+        """Results of all the answers to a question, in one query.
+
+        Returns:
+            Tuple (names of the tests of the question, results of every answer)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT r.student, r.status, r.message, t.test_name, t.outcome, t.message
+                FROM runs r
+                LEFT JOIN test_results t ON t.question_id = r.question_id AND t.student = r.student
+                WHERE r.question_id = ?
+                ORDER BY r.student""",
+                (question_id,),
+            ).fetchall()
+
+        test_names = {}
+        answers: List[AnswerResults] = []
+        for student, status, run_message, test_name, outcome, message in rows:
+            if not answers or answers[-1].student != student:
+                answers.append(AnswerResults(student, status, run_message))
+            if test_name is not None:
+                answers[-1].tests[test_name] = (outcome, message)
+                test_names[test_name] = None
+        return list(test_names), answers
+
+    def question_report(self, question_id: int) -> QuestionReport:
+        """Pass rate histogram and failures of every test of a question, in one pass over its rows."""
+        test_names, answers = self.answer_results(question_id)
+        report = QuestionReport(question_id, tests={name: TestFailures(name) for name in test_names})
+
+        # The tests an answer did not reach (load error, timeout...) count as failed
+        for answer in answers:
+            report.statuses[answer.status] += 1
+            report.answers += 1
+            passed = 0
+            for name, failures in report.tests.items():
+                outcome, message = answer.outcome(name)
+                failures.total += 1
+                if outcome == "passed":
+                    passed += 1
+                else:
+                    failures.failed += 1
+                    failures.messages[message or outcome] += 1
+            rate = passed / len(report.tests) if report.tests else 0.0
+            report.pass_rates[pass_rate_bucket(rate)] += 1
+
+        report.tests = dict(sorted(report.tests.items(), key=lambda item: -item[1].rate))
+        return report
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def print_report(report: QuestionReport, name=None, top: int = 3):
+    print(f"{name or f'question {report.question_id}'}: {report.answers} answers")
+    print("  pass rate: " + ", ".join(f"{label}: {n}" for label, n in report.pass_rates.items()))
+    for failures in report.tests.values():
+        if not failures.failed:
+            continue
+        print(f"  {failures.name}: {failures.rate:.0%} fail ({failures.failed}/{failures.total})")
+        for message, n in failures.messages.most_common(top):
+            print(f"    {n:>3} x {message.splitlines()[0][:120]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the unit test results recorded for an exam")
+    parser.add_argument("exam_filepath", help="Exam YAML file path, or sharded exam folder")
+    parser.add_argument("-q", "--question", type=int, nargs="+", dest="question_ids",
+                        help="Only report these question ids")
+    parser.add_argument("--top", type=int, default=3,
+                        help="Number of failure messages shown per test (default: 3)")
+    args = parser.parse_args()
+
+    filepath = database_path(args.exam_filepath)
+    if not filepath.exists():
+        print(f"No test results for {args.exam_filepath}: run the unit tests first")
+        sys.exit(1)
+
+    header = exam_store.load_header(args.exam_filepath)
+    names = {q["id"]: q.get("name") for q in header.get("questions") or []}
+    store = TestResultsStore(filepath)
+    try:
+        for question_id in args.question_ids or store.question_ids():
+            print_report(store.question_report(question_id), names.get(question_id), args.top)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Warm worker processes running the unit tests of the answers.
+
+Starting a Python interpreter for every answer costs far more than running
+the tests of a short exercise. A worker is a long-lived interpreter, with the
+harness and the common modules already imported, that runs the tests of one
+answer at a time in a forked child:
+
+- The child applies the sandbox (limits and network, see `sandbox.py`), runs
+  `harness.py` in the folder of the answer, and exits. Nothing the answer does
+  outlives it.
+- The worker waits for the child (killing its process group after the wall time
+  limit), and reports how it ended.
+
+`WorkerPool` drives a pool of workers from the runner. A worker is replaced
+after `max_jobs` answers, or when it dies.
+
+The workers wait for their children with `os.pidfd_open` (Linux 5.3+): on the
+other systems, the runner starts a new interpreter for every answer instead.
+
+Protocol (one JSON object per line, on the stdin / stdout of the worker):
+    request:  {"folder": "...", "time_limit": 10, "memory_limit": 512}
+    response: {"returncode": 0, "timed_out": false}
+"""
+
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import traceback
+
+SCRIPTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_FOLDER)
+
+import harness
+import sandbox
+
+
+# Imported once by the worker, so the children don't import them for each answer
+PRELOADED_MODULES = [
+    "bisect", "collections", "copy", "dataclasses", "functools", "heapq", "itertools",
+    "math", "random", "re", "statistics", "string", "typing", "unittest",
+]
+
+DEFAULT_MAX_JOBS = 200
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+def pool_available() -> bool:
+    """Whether the workers can run on this system."""
+    if not hasattr(os, "fork") or not hasattr(os, "pidfd_open"):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        # Python built with pidfd_open, running on a kernel older than 5.3
+        return False
+    return True
+
+
+def run_child(folder: str, time_limit: int, memory_limit: int):
+    """Body of the forked child: never returns."""
+    code = 0
+    try:
+        os.setpgid(0, 0)
+        os.chdir(folder)
+        # The stdout of the worker is the protocol pipe: keep the answer away from it
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        stdout = os.open("stdout.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        stderr = os.open("stderr.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(devnull, 0)
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+        sys.stderr = open(2, "w", encoding="utf-8", closefd=False)
+
+        sandbox.isolate_network()
+        sandbox.apply_limits(cpu=time_limit, memory=memory_limit, file_size=16)
+        harness.block_network()
+        harness.run("solution.py", "tests.py", "results.jsonl")
+    except MemoryError:
+        code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def wait_child(pid: int, timeout: float) -> dict:
+    """Wait for a child, killing its process group after `timeout` seconds."""
+    timed_out = False
+    pidfd = os.pidfd_open(pid)
+    try:
+        ready, _, _ = select.select([pidfd], [], [], timeout)
+        if not ready:
+            timed_out = True
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    finally:
+        os.close(pidfd)
+
+    _, status = os.waitpid(pid, 0)
+    return {"returncode": os.waitstatus_to_exitcode(status), "timed_out": timed_out}
+
+
+def serve():
+    """Main loop of a worker: run the requests read from stdin."""
+    for name in PRELOADED_MODULES:
+        __import__(name)
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        time_limit = request["time_limit"]
+        pid = os.fork()
+        if pid == 0:
+            run_child(request["folder"], time_limit, request["memory_limit"])
+        response = wait_child(pid, 2 * time_limit + 5)
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+
+class Worker:
+    """Client side of one worker process."""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            # -I: ignore the environment and the user site-packages
+            [sys.executable, "-I", os.path.join(SCRIPTS_FOLDER, "worker.py")],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env={"PATH": os.environ.get("PATH", ""), "LANG": "C.UTF-8"},
+            text=True,
+            start_new_session=True,
+        )
+        self.jobs = 0
+
+    def run(self, request: dict) -> dict:
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerCrashed(str(e)) from e
+        if not line:
+            raise WorkerCrashed(f"Worker exited with code {self.process.wait()}")
+        self.jobs += 1
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class WorkerPool:
+    """
+    Pool of warm workers, usable from several threads.
+
+    Each call to `run` uses one idle worker (starting one if needed, up to
+    `size`), which is recycled after `max_jobs` answers.
+    """
+
+    def __init__(self, size: int, max_jobs: int = DEFAULT_MAX_JOBS):
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle = []
+        self._started = 0
+        self._condition = threading.Condition()
+
+    def _acquire(self) -> Worker:
+        with self._condition:
+            while not self._idle and self._started >= self.size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        try:
+            return Worker()
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, worker: Worker = None):
+        """Give a worker back to the pool, None for a worker that died."""
+        retired = None
+        with self._condition:
+            if worker is not None and worker.jobs < self.max_jobs:
+                self._idle.append(worker)
+            else:
+                # Replaced by a new worker on the next `_acquire`
+                self._started -= 1
+                retired = worker
+            self._condition.notify()
+        if retired is not None:
+            retired.close()
+
+    def run(self, folder: str, time_limit: int, memory_limit: int) -> dict:
+        """Run the tests in `folder` (see `harness.py`) in a worker.
+
+        Returns:
+            Dict with the `returncode` of the child, and whether it `timed_out`
+        """
+        worker = self._acquire()
+        try:
+            response = worker.run(
+                {"folder": folder, "time_limit": time_limit, "memory_limit": memory_limit}
+            )
+        except WorkerCrashed:
+            worker.process.kill()
+            worker.process.wait()
+            self._release(None)
+            raise
+        self._release(worker)
+        return response
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+        for worker in idle:
+            worker.close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,55 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "models"))
+
+from fingerprint import answer_fingerprint, normalize_answer
+
+
+def fingerprints(question, *answers):
+    return [answer_fingerprint(answer, question) for answer in answers]
+
+
+def test_renamed_variables_share_a_fingerprint():
+    question = {"id": 1, "type": "python", "description": "Write the function `mean`."}
+    a, b = fingerprints(
+        question,
+        "def mean(values):\n    total = 0\n    for v in values:\n        total += v\n    return total / len(values)\n",
+        "def mean(xs):\n    s = 0  # sum\n    for x in xs:\n        s += x\n    return s / len(xs)\n",
+    )
+    assert a == b
+
+
+def test_imported_names_are_kept():
+    question = {"id": 1, "type": "python", "description": "Write `round_down(x)`."}
+    floor, ceil = fingerprints(
+        question,
+        "from math import floor\n\ndef round_down(x):\n    return floor(x)\n",
+        "from math import ceil\n\ndef round_down(x):\n    return ceil(x)\n",
+    )
+    assert floor != ceil
+
+
+def test_free_names_are_kept():
+    question = {"id": 2, "type": "cpp", "description": "Write `void arrange(vector<int>& v)`."}
+    sort, reverse = fingerprints(
+        question,
+        "#include <algorithm>\nusing namespace std;\nvoid arrange(vector<int>& v) {\n    sort(v.begin(), v.end());\n}\n",
+        "#include <algorithm>\nusing namespace std;\nvoid arrange(vector<int>& v) {\n    reverse(v.begin(), v.end());\n}\n",
+    )
+    assert sort != reverse
+
+
+def test_c_like_declarations_are_renamed():
+    kept = {"total"}
+    a = normalize_answer("int total(const vector<int>& v) { int s = 0, i = 0; for (int x : v) s += x; return s; }", "cpp", kept)
+    b = normalize_answer("int total(const vector<int>& w) { int t = 0, j = 0; for (int y : w) t += y; return t; }", "cpp", kept)
+    assert a == b
+    assert "std :: sort" in normalize_answer("std::sort(v.begin(), v.end());", "cpp")
+
+
+def test_javascript_parameters_are_renamed():
+    kept = {"evens"}
+    a = normalize_answer("function evens(values) { return values.filter(v => v % 2 === 0); }", "javascript", kept)
+    b = normalize_answer("function evens(xs) { return xs.filter(x => x % 2 === 0); }", "javascript", kept)
+    assert a == b
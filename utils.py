@@ -189,3 +189,92 @@ def log_agent_state(logger: logging.Logger, result):
     
     except Exception as e:
         logger.error(f"Error logging agent state: {e}", exc_info=True)
+
+
+def summarize_token_usage(messages) -> dict:
+    """Sum the token usage reported on the AI messages of a turn.
+
+    Returns:
+        Dict with input, output, cache_read (input tokens served from the provider
+        prompt cache) and cache_creation (input tokens written to it)
+    """
+    usage = {"input": 0, "output": 0, "cache_read": 0, "cache_creation": 0}
+    for msg in messages:
+        metadata = getattr(msg, "usage_metadata", None)
+        if not metadata:
+            continue
+        usage["input"] += metadata.get("input_tokens") or 0
+        usage["output"] += metadata.get("output_tokens") or 0
+        details = metadata.get("input_token_details") or {}
+        usage["cache_read"] += details.get("cache_read") or 0
+        usage["cache_creation"] += details.get("cache_creation") or 0
+    return usage
+
+
+def estimate_cache_savings(model_name: str, usage: dict):
+    """Estimate the cost saved by the prompt cache (in USD), None if the model prices are unknown."""
+    try:
+        import litellm
+        prices = litellm.model_cost.get(model_name) or litellm.model_cost.get(model_name.split("/", 1)[-1])
+        input_cost = prices["input_cost_per_token"]
+        cache_read_cost = prices.get("cache_read_input_token_cost")
+    except Exception:
+        return None
+    if cache_read_cost is None:
+        return None
+    return usage["cache_read"] * (input_cost - cache_read_cost)
+
+
+def print_usage(usage: dict, savings=None):
+    """Print the token usage of a turn in grey."""
+    GREY = "\033[90m"
+    RESET = "\033[0m"
+    line = f"Tokens: {usage['input']} in ({usage['cache_read']} cached), {usage['output']} out"
+    if savings:
+        line += f" - prompt cache saved ~${savings:.4f}"
+    print(f"{GREY}{line}{RESET}")
+
+
+class StreamPrinter:
+    """Print a streamed agent turn: response tokens in blue, tool calls in grey."""
+    
+    BLUE = "\033[94m"
+    GREY = "\033[90m"
+    RESET = "\033[0m"
+    
+    def __init__(self):
+        self.in_text = False
+    
+    def token(self, text: str):
+        """Print a chunk of the response."""
+        if not text:
+            return
+        if not self.in_text:
+            sys.stdout.write(f"{self.BLUE}OpenGrader: ")
+            self.in_text = True
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    
+    def _end_text(self):
+        if self.in_text:
+            sys.stdout.write(f"{self.RESET}\n")
+            self.in_text = False
+    
+    def tool_call(self, name: str, args: dict):
+        """Print a tool call, with its first argument (usually a path) as a hint."""
+        self._end_text()
+        hint = ""
+        if args:
+            value = str(next(iter(args.values())))
+            hint = value if len(value) <= 60 else value[:57] + "..."
+        print(f"{self.GREY}  → {name}({hint}){self.RESET}", flush=True)
+    
+    def tool_result(self, name: str, failed: bool = False):
+        """Print the end of a tool call."""
+        self._end_text()
+        status = "failed" if failed else "done"
+        print(f"{self.GREY}  ✓ {name} {status}{self.RESET}", flush=True)
+    
+    def end(self):
+        """End the turn."""
+        self._end_text()